@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Checks how --densities sizes each document it writes: a width & height given
+as lengths are scaled by the density (keeping their units) with the original
+size as the viewBox, while a document sized by percentage is rejected with an
+error, and nothing is written.
+
+Usage:
+    python benchmarks/density_canvas.py           exits with status 1 if any
+                                                  case goes wrong
+"""
+
+import sys, os, re, shutil, subprocess, tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+SCRIPT = os.path.join(ROOT, 'pixelsnap.py')
+DEMO_FILE = os.path.join(ROOT, 'demo.svg')
+DENSITIES = (1, 2, 1.5)
+TOLERANCE = 1e-5                # format_number keeps 5 decimal places
+
+# (name, width, height) for the root element, and whether --densities should
+# accept the document
+CASES = (('lengths', '744.09448819', '1052.3622047', True), ('units', '210mm', '297mm', True),
+         ('percentage width', '100%', '1052.3622047', False), ('percentage height', '744.09448819', ' 50% ', False))
+
+def variant(directory, width, height):
+    """ A copy of demo.svg with the given width & height, in directory """
+    from lxml import etree
+    document = etree.parse(DEMO_FILE)
+    svg = document.getroot()
+    for attr, value in (('width', width), ('height', height)):
+        svg.set(attr, value)
+    filename = os.path.join(directory, 'drawing.svg')
+    document.write(filename)
+    return filename
+
+def check(directory, width, height, accepted):
+    """ Returns a list of what went wrong for one case """
+    from lxml import etree
+    filename = variant(directory, width, height)
+    output = os.path.join(directory, 'out')
+    os.mkdir(output)
+    args = [sys.executable, SCRIPT, '--select_all=true', '--densities=%s' % ','.join(map(str, DENSITIES)),
+            '--density_dir=%s' % output, filename]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err = process.communicate()[1]
+
+    if not accepted:
+        problems = []
+        if process.returncode != 1: problems.append('exit status %d, not 1' % process.returncode)
+        if '--densities needs' not in err: problems.append('unexpected error: %s' % (err.strip() or 'none'))
+        if os.listdir(output): problems.append('wrote %s' % ', '.join(sorted(os.listdir(output))))
+        return problems
+
+    if process.returncode: return ['failed: %s' % err.strip()]
+    problems = []
+    for density in DENSITIES:
+        name = os.path.join(output, 'drawing@%gx.svg' % density)
+        if not os.path.exists(name):
+            problems.append('no %s' % os.path.basename(name))
+            continue
+        svg = etree.parse(name).getroot()
+        for attr, original in (('width', width), ('height', height)):
+            number, unit = re.match(r'([\d.]+)(.*)', original).groups()
+            number2, unit2 = re.match(r'([\d.]+)(.*)', svg.get(attr)).groups()
+            if unit2 != unit or abs(float(number2) - float(number) * density) > TOLERANCE:
+                problems.append('@%gx %s is %s, not %s times %s' % (density, attr, svg.get(attr), density, original))
+        if density != 1 and not svg.get('viewBox'):
+            problems.append('@%gx has no viewBox' % density)
+    return problems
+
+def main(args=sys.argv[1:]):
+    failed = False
+    for name, width, height, accepted in CASES:
+        directory = tempfile.mkdtemp()
+        try:
+            problems = check(directory, width, height, accepted)
+        finally:
+            shutil.rmtree(directory)
+        for problem in problems:
+            print "%s: %s" % (name, problem)
+        failed = failed or bool(problems)
+    print failed and "FAIL: --densities sizes some documents wrongly" or \
+                     "OK: --densities scales lengths & rejects percentages"
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Checks that snap_path_intent still gives the same results on tests.svg as it
+did when the results were recorded, so that reimplementing or speeding it up
+can't quietly change what it does.
+
+Each of a representative set of the paths in tests.svg (CASES) is snapped on
+its own with snap_path_intent (with the parent transform effect() would have
+used), for each of a few max_gradient settings, and the resulting points are
+compared with intent_parity.json.
+
+Usage:
+    python benchmarks/intent_parity.py            exits with status 1 if any
+                                                  path differs
+    python benchmarks/intent_parity.py --record   records the current results
+"""
+
+import sys, os, json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+RESULTS_FILE = os.path.join(HERE, 'intent_parity.json')
+TEST_FILE = os.path.join(os.path.dirname(HERE), 'tests.svg')
+GRADIENTS = (0.5, 5.0, 50.0)
+TOLERANCE = 1e-9
+DIGITS = 10                     # decimal places recorded, well within TOLERANCE
+
+# One path of each size (in points) that tests.svg has, both where max_gradient
+# changes the result and where it doesn't, a couple of the same shapes under
+# other transforms, and one of each TransformError
+CASES = ('path2906', 'path2820', 'path2820-04', 'path4710', 'path3687', 'path3199', 'path3649', 'path3346',
+         'path3201', 'path3201-7', 'path3647', 'path3666', 'path3643', 'path3232', 'path2820-0')
+
+def snap_all(max_gradient):
+    """ Returns {path: snapped points, or the TransformError message} """
+    from lxml import etree
+    import inkex
+    from pixelsnap import PixelSnapEffect, TransformError, unittouu
+
+    effect = PixelSnapEffect()
+    effect.getoptions(['--modify_shapes=shape', '--max_gradient=%s' % max_gradient])
+    effect.document = etree.parse(TEST_FILE)
+    effect.document_offset = unittouu(effect.document.getroot().attrib['height']) % 1
+    elems = [elem for elem in effect.document.getroot().iter(inkex.addNS('path', 'svg')) if elem.get('id') in CASES]
+    effect.plan_ancestors(elems)
+
+    results = {}
+    for elem in elems:
+        key = elem.get('id') or effect.document.getpath(elem)
+        try:
+            parent_transform = effect.ancestor_transforms[elem.getparent()]
+            if isinstance(parent_transform, TransformError): raise parent_transform
+            path = effect.path_geometry(elem)
+            effect.snap_path_intent(elem, parent_transform, path)
+            results[key] = [[round(v, DIGITS) for v in point] for point in path.points.tolist()]
+        except TransformError, e:
+            results[key] = str(e)
+    return results
+
+def compare(expected, actual):
+    """ Returns a list of the paths that differ, with how """
+    differences = []
+    for key in sorted(set(expected) | set(actual)):
+        if key not in actual or key not in expected:
+            differences.append('%s: only in %s' % (key, key in actual and 'the current results' or 'the recorded results'))
+        elif isinstance(expected[key], basestring) or isinstance(actual[key], basestring):
+            if expected[key] != actual[key]:
+                differences.append('%s: %r, was %r' % (key, actual[key], expected[key]))
+        elif len(expected[key]) != len(actual[key]):
+            differences.append('%s: %d points, was %d' % (key, len(actual[key]), len(expected[key])))
+        else:
+            worst = max([abs(a - b) for pa, pb in zip(actual[key], expected[key]) for a, b in zip(pa, pb)] or [0])
+            if worst > TOLERANCE:
+                differences.append('%s: points moved by up to %g' % (key, worst))
+    return differences
+
+def write_results(results, filename):
+    """ Writes results as JSON, with each path's points on one line """
+    gradients = []
+    for gradient in sorted(results, key=float):
+        paths = ['  %s: %s' % (json.dumps(key), json.dumps(value)) for key, value in sorted(results[gradient].items())]
+        gradients.append(' %s: {\n%s\n }' % (json.dumps(gradient), ',\n'.join(paths)))
+    open(filename, 'w').write('{\n%s\n}\n' % ',\n'.join(gradients))
+
+def main(args=sys.argv[1:]):
+    results = dict(('%g' % gradient, snap_all(gradient)) for gradient in GRADIENTS)
+
+    if '--record' in args:
+        write_results(results, RESULTS_FILE)
+        print "Recorded snap_path_intent results for %d paths in %s" % (len(results['%g' % GRADIENTS[0]]), RESULTS_FILE)
+        return 0
+
+    expected = json.load(open(RESULTS_FILE))
+    failed = False
+    for gradient in sorted(results, key=float):
+        differences = compare(expected.get(gradient, {}), results[gradient])
+        for difference in differences:
+            print "max_gradient=%s: %s" % (gradient, difference)
+        failed = failed or bool(differences)
+    print failed and "FAIL: snap_path_intent's results have changed" or \
+                     "OK: snap_path_intent gives the recorded results for every path"
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
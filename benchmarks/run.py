@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Times each of PixelSnap's snapping modes on synthetic documents (see
+workload.py), and reports throughput in nodes & elements per second along
+with peak memory use.
+
+Usage:
+    python benchmarks/run.py [--workloads=icons,glyphs,deep] [--benchmarks=...]
+                             [--repeat=3] [--threshold=15] [--no-save]
+
+Each benchmark runs in its own process, so that peak memory is its own and
+nothing is warmed up by a previous benchmark. The time reported is the best
+of --repeat runs, each on a freshly parsed document (parsing the document
+isn't timed, but parsing & formatting path data is).
+
+Results are saved in benchmarks/results/, named by date & git revision, and
+compared against the most recent earlier results: anything more than
+--threshold percent slower is flagged as a regression, and the exit status
+is 1.
+"""
+
+from __future__ import division
+
+import sys, os, time, json, glob, subprocess, optparse, resource
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, 'results')
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import workload
+
+Workloads = {
+    'icons':  dict(elements=2000, nodes=12, depth=2, curves=0.2),             # lots of small, mostly straight shapes
+    'glyphs': dict(elements=150, nodes=150, subpaths=3, depth=1, curves=0.6, rects=0),  # fewer, bigger, curvier paths
+    'deep':   dict(elements=2000, nodes=8, depth=12, scale=0.05),             # deeply nested groups
+}
+
+Benchmarks = ['pos_scale', 'intent', 'shape', 'rect', 'effect_size_and_position', 'effect_shape']
+
+# ------------------------------------------------------------------ running a single benchmark
+
+def prepare(svg, modify_shapes):
+    """ Returns an effect, ready to run, with everything in every layer selected """
+    from lxml import etree
+    from pixelsnap import PixelSnapEffect
+    effect = PixelSnapEffect()
+    effect.getoptions(['--modify_shapes=' + modify_shapes, '--select_all=true'])
+    effect.document = etree.ElementTree(etree.fromstring(svg))
+    effect.getselected()
+    return effect
+
+def stage_elements(effect, tag):
+    """ Every element of the given type, with its parent_transform, as
+        effect() would have worked them out
+    """
+    import inkex
+    from pixelsnap import unittouu
+    effect.document_offset = unittouu(effect.document.getroot().attrib['height']) % 1
+    elems = list(effect.document.getroot().iter(inkex.addNS(tag, 'svg')))
+    effect.plan_ancestors(elems)
+    return [(elem, effect.ancestor_transforms[elem.getparent()]) for elem in elems]
+
+def run_stages(effect, elems, stages):
+    from pixelsnap import TransformError
+    errors = 0
+    for elem, parent_transform in elems:
+        path = effect.path_geometry(elem)
+        try:
+            for stage in stages:
+                stage(elem, parent_transform, path)
+        except TransformError:
+            errors += 1
+        effect.write_path(elem, path)
+    return errors
+
+def run_rects(effect, elems):
+    from pixelsnap import TransformError
+    errors = 0
+    for elem, parent_transform in elems:
+        try:
+            effect.snap_rect(elem, parent_transform)
+        except TransformError:
+            errors += 1
+    return errors
+
+def count(svg):
+    """ Returns (number of elements, number of path nodes) in the document """
+    from lxml import etree
+    import inkex, simplepath
+    root = etree.fromstring(svg)
+    paths = list(root.iter(inkex.addNS('path', 'svg')))
+    rects = list(root.iter(inkex.addNS('rect', 'svg')))
+    return len(paths), len(rects), sum(len(simplepath.parsePath(p.get('d'))) for p in paths)
+
+def run_one(benchmark, params, repeat):
+    svg = workload.generate(**params)
+    paths, rects, nodes = count(svg)
+
+    best = None
+    for i in range(repeat):
+        if benchmark.startswith('effect_'):
+            effect = prepare(svg, benchmark[len('effect_'):])
+            start = time.time()
+            effect.effect()
+            elapsed = time.time() - start
+            errors = len(effect.errors)
+            elements = paths + rects
+        elif benchmark == 'rect':
+            effect = prepare(svg, 'size_and_position')
+            elems = stage_elements(effect, 'rect')
+            start = time.time()
+            errors = run_rects(effect, elems)
+            elapsed = time.time() - start
+            elements, nodes = rects, 4 * rects
+        else:
+            effect = prepare(svg, 'shape')
+            elems = stage_elements(effect, 'path')
+            stages = {'pos_scale': [effect.snap_path_pos, effect.snap_path_scale],
+                      'intent': [effect.snap_path_intent],
+                      'shape': [effect.snap_path_shape]}[benchmark]
+            start = time.time()
+            errors = run_stages(effect, elems, stages)
+            elapsed = time.time() - start
+            elements = paths
+        best = best is None and elapsed or min(best, elapsed)
+
+    return {
+        'seconds': round(best, 4),
+        'elements': elements,
+        'nodes': nodes,
+        'elements_per_sec': round(elements / best, 1) if best else None,
+        'nodes_per_sec': round(nodes / best, 1) if best else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'errors': errors,
+    }
+
+# ------------------------------------------------------------------ running them all
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def previous_results():
+    files = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')))
+    return files and (files[-1], json.load(open(files[-1]))) or (None, None)
+
+def main(args=sys.argv[1:]):
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option('--workloads', default=','.join(sorted(Workloads)))
+    parser.add_option('--benchmarks', default=','.join(Benchmarks))
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--threshold', type='float', default=15, help="% slower that counts as a regression")
+    parser.add_option('--no-save', action='store_true', dest='no_save', default=False)
+    parser.add_option('--one', nargs=2, help=optparse.SUPPRESS_HELP)     # BENCHMARK WORKLOAD, run in a child process
+    options, args = parser.parse_args(args)
+
+    if options.one:
+        benchmark, name = options.one
+        print json.dumps(run_one(benchmark, Workloads[name], options.repeat))
+        return 0
+
+    results = {'revision': revision(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python': sys.version.split()[0], 'workloads': {}}
+    previous_file, previous = previous_results()
+
+    regressions = []
+    print "%-8s %-26s %9s %14s %14s %10s %7s" % ('workload', 'benchmark', 'seconds', 'elements/sec', 'nodes/sec', 'peak RSS', 'change')
+    for name in options.workloads.split(','):
+        results['workloads'][name] = {'params': Workloads[name], 'benchmarks': {}}
+        for benchmark in options.benchmarks.split(','):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--repeat=%d' % options.repeat,
+                                              '--one', benchmark, name])
+            result = json.loads(output.splitlines()[-1])
+            results['workloads'][name]['benchmarks'][benchmark] = result
+
+            change = ''
+            try:
+                before = previous['workloads'][name]['benchmarks'][benchmark]['seconds']
+                if previous['workloads'][name]['params'] == Workloads[name] and before:
+                    percent = (result['seconds'] - before) / before * 100
+                    change = '%+.0f%%' % percent
+                    if percent > options.threshold:
+                        regressions.append('%s/%s' % (name, benchmark))
+                        change += ' !'
+            except (KeyError, TypeError):
+                pass
+            print "%-8s %-26s %9.3f %14s %14s %8dKB %7s" % (name, benchmark, result['seconds'], result['elements_per_sec'],
+                                                            result['nodes_per_sec'], result['peak_rss_kb'], change)
+
+    if previous_file:
+        print "\nCompared with %s" % os.path.basename(previous_file)
+    if not options.no_save:
+        if not os.path.isdir(RESULTS_DIR): os.makedirs(RESULTS_DIR)
+        filename = os.path.join(RESULTS_DIR, '%s-%s.json' % (time.strftime('%Y%m%d-%H%M%S'), results['revision']))
+        json.dump(results, open(filename, 'w'), indent=2, sort_keys=True)
+        print "Saved results in %s" % filename
+    if regressions:
+        print "Regressions (more than %g%% slower): %s" % (options.threshold, ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Checks that importing pixelsnap stays cheap, since for a single run from the
+Inkscape menu, start-up is most of the time the user waits.
+
+Each measurement is made in a fresh interpreter, so nothing is already cached
+in-process: it imports inkex (which pixelsnap can't do without, and which
+varies a lot between installations), then loads pixelsnap, timing each. What's
+compared against the budget is pixelsnap's own overhead: the median time to
+load it, once inkex has been imported. Timing both in the same interpreter,
+rather than subtracting the times of separate runs, keeps the noise in
+importing inkex out of the overhead. It also checks that the modules
+pixelsnap loads lazily aren't imported up-front.
+
+Inkscape runs pixelsnap.py as a script, and a script's bytecode is never
+cached, so pixelsnap.py is compiled from source for every measurement, as it
+is for every run -- whether or not there's a pixelsnap.pyc lying around from
+importing it elsewhere. The interpreters run with -B, so that measuring
+doesn't write any .pyc files of its own.
+
+Usage:
+    python benchmarks/startup.py            exits with status 1 if over budget
+    python benchmarks/startup.py --record   writes the current overhead (with
+                                            some headroom) as the new budget
+"""
+
+import sys, os, json, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGET_FILE = os.path.join(HERE, 'startup_budget.json')
+RUNS = 15
+HEADROOM = 1.5, 10             # --record allows 50% or 10ms of slack over the measured overhead, whichever's more
+LAZY = ('numpy', 'simplestyle', 'simpletransform', 'simplepath', 'json', 'hashlib', 'sqlite3', 'pixelsnap_path',
+        'pixelsnap_shape', 'pixelsnap_audit', 'pixelsnap_stream', 'pixelsnap_xml', 'pixelsnap_densities',
+        'pixelsnap_partition', 'pixelsnap_clones', 'pixelsnap_cache', 'pixelsnap_index', 'pixelsnap_profile')
+SCRIPT = os.path.join(os.path.dirname(HERE), 'pixelsnap.py')
+
+def load_times():
+    """ Median seconds to import inkex, and then to load pixelsnap, in a
+        fresh interpreter, and the lazily loaded modules that were imported.
+        pixelsnap is compiled from pixelsnap.py, as when it's run as a script.
+    """
+    code = ("import sys, time, imp\n"
+            "sys.path.insert(0, %r)\n"
+            "start = time.time()\n"
+            "import inkex\n"
+            "middle = time.time()\n"
+            "module = sys.modules['pixelsnap'] = imp.new_module('pixelsnap')\n"
+            "exec compile(open(%r).read(), %r, 'exec') in module.__dict__\n"
+            "print middle - start, time.time() - middle\n"
+            "print ' '.join(name for name in %r if name in sys.modules)\n") % (os.path.dirname(HERE), SCRIPT, SCRIPT, LAZY)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    inkex_times, pixelsnap_times = [], []
+    for i in range(RUNS):
+        output = subprocess.check_output([sys.executable, '-B', '-c', code], env=env).splitlines()
+        inkex_time, pixelsnap_time = [float(t) for t in output[0].split()]
+        inkex_times.append(inkex_time)
+        pixelsnap_times.append(pixelsnap_time)
+        loaded = output[1:] and output[1].split() or []
+    median = lambda times: sorted(times)[len(times) // 2]
+    return median(inkex_times), median(pixelsnap_times), loaded
+
+def main(args=sys.argv[1:]):
+    baseline, overhead, loaded = load_times()
+    overhead_ms = overhead * 1000
+
+    print "import inkex:     %7.1fms" % (baseline * 1000)
+    print "load pixelsnap:   %7.1fms over inkex" % overhead_ms
+
+    if '--record' in args:
+        budget = round(max(overhead_ms * HEADROOM[0], overhead_ms + HEADROOM[1]), 1)
+        json.dump({'max_import_overhead_ms': budget}, open(BUDGET_FILE, 'w'), indent=4)
+        print "Recorded a budget of %.1fms in %s" % (budget, BUDGET_FILE)
+        return 0
+
+    failed = False
+    if loaded:
+        print "FAIL: importing pixelsnap loaded %s, which should only be imported when needed" % ', '.join(loaded)
+        failed = True
+    budget = json.load(open(BUDGET_FILE))['max_import_overhead_ms']
+    if overhead_ms > budget:
+        print "FAIL: over the start-up budget of %.1fms" % budget
+        failed = True
+    else:
+        print "OK: within the start-up budget of %.1fms" % budget
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Checks that --stream=true snaps a selection (--id) just as a plain run does,
+so that the layers & groups that don't hold the selection are left as they
+are rather than snapped as its ancestors.
+
+Each case in CASES is run through pixelsnap.py both ways, and the documents
+written are compared (in canonical form, so that how they happen to be
+serialized doesn't matter). demo.svg is also run with one of its groups
+moved off the pixel grid, next to the group the selection is in.
+
+Usage:
+    python benchmarks/stream_parity.py            exits with status 1 if any
+                                                  case differs
+"""
+
+import sys, os, subprocess, tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+SCRIPT = os.path.join(ROOT, 'pixelsnap.py')
+TEST_FILE = os.path.join(ROOT, 'tests.svg')
+DEMO_FILE = os.path.join(ROOT, 'demo.svg')
+
+# In tests.svg, g3801 & g3809 are both translated by (536.99999,1043): a path
+# in one, paths in a couple of the nested groups, one in the layer itself, and
+# a selected group
+CASES = ((TEST_FILE, ('path2906',)), (TEST_FILE, ('path3346', 'rect3364')), (TEST_FILE, ('rect2863',)),
+         (TEST_FILE, ('g3344', 'path3705')))
+
+def snapped(filename, ids, stream):
+    """ The document pixelsnap.py writes for the given selection, in
+        canonical form, and what it wrote to stderr
+    """
+    from lxml import etree
+    args = [sys.executable, SCRIPT] + ['--id=%s' % id for id in ids] + ['--stream=%s' % str(stream).lower(), filename]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode: return None, err
+    return etree.tostring(etree.fromstring(out, etree.XMLParser(huge_tree=True)).getroottree(), method='c14n'), err
+
+def off_grid_demo():
+    """ A copy of demo.svg with g3809, which is next to the group holding
+        rect3797, moved off the pixel grid
+    """
+    from lxml import etree
+    document = etree.parse(DEMO_FILE)
+    for elem in document.getroot().iter():
+        if elem.get('id') == 'g3809': elem.set('transform', 'translate(234.3,229.4)')
+    handle, filename = tempfile.mkstemp(suffix='.svg')
+    os.fdopen(handle, 'wb').write(etree.tostring(document))
+    return filename
+
+def main(args=sys.argv[1:]):
+    demo = off_grid_demo()
+    try:
+        failed = False
+        for filename, ids in CASES + ((demo, ('rect3797',)),):
+            name = '%s --id=%s' % (filename == demo and 'demo.svg (g3809 off the grid)' or os.path.basename(filename),
+                                   ','.join(ids))
+            plain, stream = snapped(filename, ids, False), snapped(filename, ids, True)
+            if plain[0] is None or stream[0] is None:
+                print "%s: failed:\n%s" % (name, plain[0] is None and plain[1] or stream[1])
+                failed = True
+            elif plain != stream:
+                print "%s: %s differs from a plain run" % (name, plain[0] != stream[0] and 'the document' or 'stderr')
+                failed = True
+    finally:
+        os.unlink(demo)
+    print failed and "FAIL: --stream snaps a selection differently from a plain run" or \
+                     "OK: --stream snaps every selection as a plain run does"
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+Generates synthetic SVG documents for benchmarking PixelSnap, with the knobs
+that matter for its performance: how many elements there are, how many nodes
+each path has, how deeply they're nested in groups, what transforms are
+applied, stroke widths, and how many of the segments are curves.
+
+Usage:
+    python benchmarks/workload.py [options] OUTPUT.svg
+
+The same parameters (and seed) always give the same document.
+"""
+
+from __future__ import division
+
+import sys, random, optparse
+
+Defaults = {
+    'elements': 1000,               # number of paths & rects
+    'nodes': 20,                    # nodes per path
+    'subpaths': 1,                  # subpaths per path
+    'depth': 2,                     # group nesting depth (below a single layer)
+    'translate': 0.5,               # fraction of groups & elements with a (fractional) translate
+    'scale': 0.2,                   #   ... with a uniform scale
+    'rotate': 0.0,                  #   ... with a rotation (these can't be snapped, and raise TransformErrors)
+    'stroke_widths': '0,1,2,3',     # picked from at random; 0 means no stroke
+    'curves': 0.3,                  # fraction of path segments that are cubic beziers
+    'rects': 0.1,                   # fraction of elements that are rects rather than paths
+    'seed': 1,
+}
+
+def coord(rnd, lo, hi):
+    return round(rnd.uniform(lo, hi), 4)
+
+def transform(rnd, params):
+    transforms = []
+    if rnd.random() < params['translate']:
+        transforms.append('translate(%s,%s)' % (coord(rnd, -20, 20), coord(rnd, -20, 20)))
+    if rnd.random() < params['scale']:
+        transforms.append('scale(%s)' % rnd.choice((0.5, 1.5, 2, 3)))
+    if rnd.random() < params['rotate']:
+        transforms.append('rotate(%s)' % rnd.randint(1, 89))
+    return transforms and ' transform="%s"' % ' '.join(transforms) or ''
+
+def style(rnd, params):
+    width = rnd.choice([float(w) for w in str(params['stroke_widths']).split(',')])
+    if not width:
+        return 'fill:#000000;stroke:none'
+    return 'fill:none;stroke:#000000;stroke-width:%spx' % width
+
+def path_data(rnd, params):
+    d = []
+    for s in range(params['subpaths']):
+        x, y = coord(rnd, 0, 400), coord(rnd, 0, 400)
+        d.append('M %s,%s' % (x, y))
+        for n in range(params['nodes'] - 1):
+            if rnd.random() < 0.5: nx, ny = x + coord(rnd, -30, 30), y     # mostly horizontal & vertical segments, as in icons
+            else: nx, ny = x, y + coord(rnd, -30, 30)
+            if rnd.random() < 0.1: nx, ny = x + coord(rnd, -30, 30), y + coord(rnd, -30, 30)
+            if rnd.random() < params['curves']:
+                d.append('C %s,%s %s,%s %s,%s' % (x + coord(rnd, -10, 10), y + coord(rnd, -10, 10),
+                                                  nx + coord(rnd, -10, 10), ny + coord(rnd, -10, 10), nx, ny))
+            else:
+                d.append('L %s,%s' % (nx, ny))
+            x, y = nx, ny
+        d.append('Z')
+    return ' '.join(d)
+
+def element(rnd, params, id):
+    if rnd.random() < params['rects']:
+        return '<rect id="rect%d" x="%s" y="%s" width="%s" height="%s" style="%s"%s />' % (
+            id, coord(rnd, 0, 400), coord(rnd, 0, 400), coord(rnd, 1, 100), coord(rnd, 1, 100),
+            style(rnd, params), transform(rnd, params))
+    return '<path id="path%d" d="%s" style="%s"%s />' % (id, path_data(rnd, params), style(rnd, params), transform(rnd, params))
+
+def generate(**params):
+    """ Returns the SVG document (as a string) for the given parameters,
+        any of which may be left out (see Defaults)
+    """
+    for k, v in Defaults.items(): params.setdefault(k, v)
+    rnd = random.Random(params['seed'])
+
+    out = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+           '<svg xmlns="http://www.w3.org/2000/svg" '
+           'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+           'width="744.09448819" height="1052.3622047" version="1.1">',
+           '<g id="layer1" inkscape:groupmode="layer" inkscape:label="Layer 1" transform="translate(0,-0.3622047)">']
+
+    # Spread the elements evenly over groups, each nested depth deep
+    groups = params['depth'] and max(1, int(params['elements'] ** 0.5)) or 1
+    id = 0
+    for g in range(groups):
+        for level in range(params['depth']):
+            out.append('<g id="g%d_%d"%s>' % (g, level, transform(rnd, params)))
+        for i in range(params['elements'] // groups + (g < params['elements'] % groups)):
+            out.append(element(rnd, params, id))
+            id += 1
+        out.extend(['</g>'] * params['depth'])
+    out.extend(['</g>', '</svg>'])
+    return '\n'.join(out)
+
+def option_parser():
+    parser = optparse.OptionParser(usage="usage: %prog [options] OUTPUT.svg")
+    for name, default in sorted(Defaults.items()):
+        kind = isinstance(default, float) and 'float' or isinstance(default, int) and 'int' or 'string'
+        parser.add_option('--' + name.replace('_', '-'), dest=name, type=kind, default=default)
+    return parser
+
+def main(args=sys.argv[1:]):
+    options, args = option_parser().parse_args(args)
+    if len(args) != 1: option_parser().error("give one output file")
+    open(args[0], 'w').write(generate(**vars(options)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
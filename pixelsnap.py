@@ -32,9 +32,10 @@ THE SOFTWARE.
   4. Click "Apply"
   5. Rinse & repeat for any other objects you want to snap.
 
-2. To install, simply copy pixelsnap.py (this file) and pixelsnap.inx into
-    your inkscape extensions directory. However, if you have Inkscape 0.47
-    or more recent, it should already be installed.
+2. To install, simply copy pixelsnap.py (this file), the pixelsnap_*.py
+    modules it loads as they're needed, and pixelsnap.inx into your inkscape
+    extensions directory. However, if you have Inkscape 0.47 or more recent,
+    it should already be installed.
 
     The exact folder may be different on your system, but it's likely to be:
       Linux: ~/.config/inkscape/extensions/
@@ -59,10 +60,69 @@ http://groups.google.com/group/pixelsnap-users/browse_thread/thread/ef3d642b5b47
     <!-- --------------------------------- -->
    </keys>
 
+5. To snap lots of files outside of Inkscape (e.g. in a build pipeline), use
+   pixelsnap_batch.py -- run it with --help for details.
+
+6. To avoid paying for Python & numpy start-up on every run, start
+   "python pixelsnap_daemon.py --serve" once, and use pixelsnap_daemon.py in
+   place of pixelsnap.py (e.g. in the <command> of pixelsnap.inx). It takes
+   the same arguments, and falls back to snapping directly if no server is
+   running. See pixelsnap_daemon.py for details.
+
+7. To check that a drawing is still pixel-aligned without changing it (e.g. in
+   CI), run with --audit=true: each misaligned element is printed to stderr,
+   with which check it failed & by how much, and the exit status is 1 if
+   there were any. --audit_tolerance & --audit_fail_fast tune it.
+
+8. To snap the same drawing for several pixel densities (e.g. @1x, @2x and
+   @3x icons), use --densities=1,2,3 (and --density_dir=DIR): the drawing is
+   snapped separately for each, as if it were that many times bigger, and
+   each is written to NAME@<density>x.svg with its width & height scaled.
+   The document's width & height have to be lengths, not percentages.
+
+9. Clones are normally only moved to a whole pixel. With --snap_clones=true
+   the element a clone refers to is snapped too, as the clone draws it.
+   Clones that draw it differently (other than by whole pixels) each get
+   their own snapped copy of it, in <defs>.
+
+10. For big documents with many layers, --layer_processes=N snaps the
+   selection in each top-level layer in its own worker process (0 for one
+   per core). The result is the same as snapping them one after another.
+
+11. --patch_output=true writes the input file back out with only the
+   attributes PixelSnap changed patched in, so everything else (formatting,
+   comments, embedded images...) is left byte-for-byte as it was.
+
+12. --cache_file=FILE keeps the result of snapping each path & shape in an
+   SQLite database that's shared between runs (and files): an element that's
+   been snapped before -- the same geometry, transforms, stroke & settings --
+   is given the stored result without being parsed or snapped again. Hits &
+   misses are printed at the end; --cache_size limits how many are kept.
+
+13. Documents too big to fit in memory (GIS exports, plotter output...) can
+   be snapped with --stream=true and --select_all=true (or --id): the file
+   is read, snapped & written out a piece at a time, so only the layers &
+   groups being read, and the element being snapped, are held in memory.
+
+14. On big selections, --time_budget=SECONDS stops snapping when the time is
+   up, leaving the rest as it was, and reports how much wasn't snapped (the
+   --profile_report lists all of it). Moving objects & snapping stroke
+   widths is done first, and the nodes of paths (which takes longest) last.
+   With --remember_snaps, running it again carries on where it left off.
+   --progress_interval=SECONDS prints how far it's got as it goes.
+
+15. To snap just one part of a huge sheet, use --select_region=x,y,w,h (in
+   user units) or --select_region=NAME, the id or label of an artboard: an
+   inkscape:page, or e.g. a rectangle marking it out. Every path, shape &
+   clone that overlaps it is selected, found with an index of their
+   bounding boxes; --index_cache=true keeps the index next to the file, so
+   that the next query is quicker.
+
 ---------------------------------------------------
 
-TODO: mark elements that have previously been snapped, along with the settings
-    used, so that the same settings can be used for that element next time when
+TODO: with --remember_snaps, snapped elements are marked with a fingerprint of
+    the settings used (see FingerprintAttr), but only so that unchanged elements
+    can be skipped. Use the same settings for that element next time when
     it's selected as part of a group (and add an option to the extension dialog
     "Use previous/default settings" which is selected by default)
 
@@ -96,22 +156,65 @@ Note: This doesn't work very well on paths which have both straight segments
         c) no attempt is made to keep equal widths equal. (or nearly-equal
            widths nearly-equal). For example, font strokes.
 
-Note: Paths that have curves & arcs on some sides of the bounding box won't
-    be snapped correctly on that side of the bounding box, and nor will they
-    be translated/resized correctly before the path is modified. Doesn't affect
-    most applications of this extension, but it highlights the fact that we
-    take a geometrically simplistic approach to inspecting & modifying the path.
+Note: The bounding box of a path takes the true extents of its curves & arcs
+    into account (see PathGeometry.bounding_box), but snapping the path's
+    shape only looks at its nodes, so curves & arcs on some sides of the path
+    won't be snapped to that side of the bounding box. Doesn't affect most
+    applications of this extension, but it highlights the fact that we take a
+    geometrically simplistic approach to modifying the path.
 """
 
 from __future__ import division
 
-import sys
+import sys, os, re, time, copy
 
-# *** numpy causes issue #4 on Mac OS 10.6.2. I use it for
-# matrix inverse -- my linear algebra's a bit rusty, but I could implement my
-# own matrix inverse function if necessary, I guess.
-from numpy import matrix
-import simplestyle, simpletransform, simplepath
+class LazyModule(object):
+    """ Stands in for a module until one of its attributes is first used, then
+        imports it and puts the real module in its place, so that we only pay
+        to import what a run actually needs. Only our own global is replaced,
+        so the pixelsnap_* modules import what they use themselves rather
+        than taking these from us.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = __import__(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+# Start-up time matters when we're run from the Inkscape menu, and importing
+# numpy alone can take longer than snapping a few objects. So these are all
+# imported on first use -- e.g. numpy is never loaded if no paths are snapped.
+# *** numpy causes issue #4 on Mac OS 10.6.2. It's only used to hold path
+# coordinates (see PathGeometry) -- transforms are inverted by Affine itself.
+numpy = LazyModule('numpy')
+simplestyle = LazyModule('simplestyle')
+simpletransform = LazyModule('simpletransform')
+simplepath = LazyModule('simplepath')
+json = LazyModule('json')
+hashlib = LazyModule('hashlib')
+
+# Likewise the parts that only some runs need, each in its own module: parsing
+# paths' nodes, --modify_shapes=shape, --audit, --stream, --patch_output,
+# --densities, --layer_processes, --snap_clones, --cache_file, --select_region
+# and --profile_report
+pixelsnap_path = LazyModule('pixelsnap_path')
+pixelsnap_shape = LazyModule('pixelsnap_shape')
+pixelsnap_audit = LazyModule('pixelsnap_audit')
+pixelsnap_stream = LazyModule('pixelsnap_stream')
+pixelsnap_xml = LazyModule('pixelsnap_xml')
+pixelsnap_densities = LazyModule('pixelsnap_densities')
+pixelsnap_partition = LazyModule('pixelsnap_partition')
+pixelsnap_clones = LazyModule('pixelsnap_clones')
+pixelsnap_cache = LazyModule('pixelsnap_cache')
+pixelsnap_index = LazyModule('pixelsnap_index')
+pixelsnap_profile = LazyModule('pixelsnap_profile')
+
+# Those modules import what they need from this one by name, but when we're
+# run as a script this module is __main__: register it as pixelsnap too, so
+# that they don't load a second copy of it
+sys.modules.setdefault('pixelsnap', sys.modules[__name__])
 
 # INKEX MODULE
 # If you get the "No module named inkex" error, uncomment the relevant line
@@ -128,8 +231,39 @@ except ImportError:
     raise ImportError("No module named inkex.\nPlease edit the file %s and see the section titled 'INKEX MODULE'" % __file__)
 
 Precision = 5                   # number of digits of precision for comparing float numbers
+Snappable = ('path', 'rect', 'image', 'g', 'use',      # element types that snap_object knows how to snap
+             'polyline', 'polygon', 'line', 'circle', 'ellipse')
+PathElements = ('path', 'polyline', 'polygon', 'line')  # snapped like paths, see PixelSnapEffect.path_geometry
+BoxElements = ('rect', 'image', 'circle', 'ellipse')    # snapped like rects, see PixelSnapEffect.box
+StrokeProperties = ('stroke', 'stroke-width')           # the (inherited) style properties we resolve, see PixelSnapEffect.computed_style
+
+# With --remember_snaps, each element we snap is marked with a fingerprint of
+# its snapped state & the settings used, so that it can be skipped next time if
+# nothing has changed. The namespace is declared once, on the root element.
+PixelSnapNS = 'urn:bryhoyt:pixelsnap'
+inkex.NSS['pixelsnap'] = PixelSnapNS
+inkex.etree.register_namespace('pixelsnap', PixelSnapNS)
+FingerprintAttr = inkex.addNS('fingerprint', 'pixelsnap')
+
+# Attributes that neither affect nor are changed by snapping, left out of the
+# keys of the --cache_file so that copies of an element share their result.
+# ResultVersion is part of every key: bump it when snapping results change.
+UncachedAttributes = ('id', FingerprintAttr, inkex.addNS('label', 'inkscape'), inkex.addNS('nodetypes', 'sodipodi'),
+                      inkex.addNS('connector-curvature', 'inkscape'))
+ResultVersion = 1
+
+# Options that change what snapping an element writes, so are part of both its
+# fingerprint and its result_key
+SnapSettings = ('modify_shapes', 'max_gradient', 'ancestor_offset', 'compact_paths', 'path_digits', 'relative_paths')
+
+ListedUnfinished = 5            # how many of the elements --time_budget left undone finish() names (--profile_report has them all)
+
+# Options that need the whole document at once, so can't be used with --stream
+StreamConflicts = ('audit', 'densities', 'patch_output', 'snap_clones', 'select_xpath', 'time_budget', 'select_region')
 
 class TransformError(Exception): pass
+class AuditFailed(Exception): pass              # raised to stop at the first misaligned element, with --audit_fail_fast
+class DocumentError(Exception): pass            # the document can't be snapped as the options ask, e.g. --densities with a percentage size
 
 def elemtype(elem, matches):
     if not isinstance(matches, (list, tuple)): matches = [matches]
@@ -137,12 +271,65 @@ def elemtype(elem, matches):
         if elem.tag == inkex.addNS(m, 'svg'): return True
     return False
 
-def invert_transform(transform):
-    transform = transform[:]    # duplicate list to avoid modifying it
-    transform += [[0, 0, 1]]
-    inverse = matrix(transform).I.tolist()
-    inverse.pop()
-    return inverse
+class Affine(object):
+    """ A 2D affine transform,
+          | a c e |
+          | b d f |
+        laid out like SVG's matrix(a,b,c,d,e,f). Treat it as an immutable value:
+        transforms are shared between elements by PixelSnapEffect's cache. The
+        inverse is calculated (in closed form) the first time it's asked for,
+        and remembered from then on.
+    """
+    __slots__ = ('a', 'b', 'c', 'd', 'e', 'f', '_inverse')
+
+    def __init__(self, a=1.0, b=0.0, c=0.0, d=1.0, e=0.0, f=0.0):
+        self.a, self.b, self.c, self.d, self.e, self.f = a, b, c, d, e, f
+        self._inverse = None
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """ From simpletransform's [[a, c, e], [b, d, f]] representation """
+        return cls(matrix[0][0], matrix[1][0], matrix[0][1], matrix[1][1], matrix[0][2], matrix[1][2])
+
+    def to_matrix(self):
+        """ To simpletransform's [[a, c, e], [b, d, f]] representation """
+        return [[self.a, self.c, self.e], [self.b, self.d, self.f]]
+
+    def __repr__(self):
+        return 'Affine(%r, %r, %r, %r, %r, %r)' % (self.a, self.b, self.c, self.d, self.e, self.f)
+
+    def skewed(self):
+        """ True if there's any skew or rotation """
+        return bool(self.b or self.c)
+
+    def compose(self, other):
+        """ Returns self * other, i.e. other is applied first, then self """
+        return Affine(self.a*other.a + self.c*other.b,
+                      self.b*other.a + self.d*other.b,
+                      self.a*other.c + self.c*other.d,
+                      self.b*other.c + self.d*other.d,
+                      self.a*other.e + self.c*other.f + self.e,
+                      self.b*other.e + self.d*other.f + self.f)
+
+    def inverse(self):
+        if self._inverse is None:
+            det = self.a*self.d - self.b*self.c
+            if det == 0:
+                raise TransformError("Selection contains a transformation that can't be inverted")
+            inverse = Affine(self.d/det, -self.b/det, -self.c/det, self.a/det,
+                             (self.c*self.f - self.d*self.e)/det,
+                             (self.b*self.e - self.a*self.f)/det)
+            inverse._inverse = self
+            self._inverse = inverse
+        return self._inverse
+
+    def apply(self, x, y):
+        return self.a*x + self.c*y + self.e, self.b*x + self.d*y + self.f
+
+    def apply_array(self, points):
+        """ apply() for a whole Nx2 array of points at once """
+        x, y = points[:, 0], points[:, 1]
+        return numpy.column_stack((self.a*x + self.c*y + self.e, self.b*x + self.d*y + self.f))
 
 def transform_point(transform, pt, inverse=False):
     """ Better than simpletransform.applyTransformToPoint,
@@ -150,29 +337,135 @@ def transform_point(transform, pt, inverse=False):
         b) it returns the new xy, rather than modifying the input
     """
     if inverse:
-        transform = invert_transform(transform)
-    
-    x = transform[0][0]*pt[0] + transform[0][1]*pt[1] + transform[0][2]
-    y = transform[1][0]*pt[0] + transform[1][1]*pt[1] + transform[1][2]
-    return x,y
+        transform = transform.inverse()
+    return transform.apply(pt[0], pt[1])
+
+def format_number(value, digits=Precision):
+    """ value rounded to digits decimal places, without a trailing '.0' """
+    number = repr(round(value, digits) + 0.0)
+    return number.endswith('.0') and number[:-2] or number
 
 def transform_dimensions(transform, width=None, height=None, inverse=False):
     """ Dimensions don't get translated. I'm not sure how much diff rotate/skew
         makes in this context, but we currently ignore anything besides scale.
     """
-    if inverse: transform = invert_transform(transform)
+    if inverse: transform = transform.inverse()
 
-    if width is not None: width *= transform[0][0]
-    if height is not None: height *= transform[1][1]
+    if width is not None: width *= transform.a
+    if height is not None: height *= transform.d
     
     if width is not None and height is not None: return width, height
     if width is not None: return width
     if height is not None: return height
 
+class NullInstrumentation(object):
+    """ Stands in for Instrumentation when it's turned off, doing as little as possible """
+    enabled = False
+
+    class Phase(object):
+        def __enter__(self): pass
+        def __exit__(self, *exc_info): pass
+    null_phase = Phase()
+
+    def phase(self, name): return self.null_phase
+    def count(self, name, n=1): pass
+    def error(self, e): pass
+    def merge(self, report): pass
+
+class Stylesheet(object):
+    """ The rules in a document's <style> elements that set any of the given
+        properties. Only simple selectors are understood: a tag, #id, .class
+        or a combination of them like "path.outline". Rules with any other
+        kind of selector (descendants, attributes, pseudo-classes...) are
+        ignored, as are @-rules.
+    """
+    selector_re = re.compile(r'^([a-zA-Z][\w-]*|\*)?((?:[#.][\w-]+)*)$')
+
+    def __init__(self, root, properties):
+        self.rules = []                 # (specificity, order, tag, id, classes, declarations, important declarations)
+        self.properties = properties
+        for style in root.iter(inkex.addNS('style', 'svg')):
+            self.parse(style.text or '', properties)
+        self.rules.sort(key=lambda rule: rule[:2])
+
+    def add(self, style):
+        """ Adds the rules of another <style> element, for when they're read
+            one at a time (see PixelSnapEffect.snap_stream)
+        """
+        self.parse(style.text or '', self.properties)
+        self.rules.sort(key=lambda rule: rule[:2])
+
+    def parse(self, css, properties):
+        css = re.sub(r'(?s)/\*.*?\*/', '', css)
+        css = re.sub(r'@[^{};]*(;|\{([^{}]*\{[^{}]*\})*[^{}]*\})', '', css)
+        for selectors, body in re.findall(r'([^{}]+)\{([^{}]*)\}', css):
+            declarations, important = {}, {}
+            for declaration in body.split(';'):
+                if ':' not in declaration: continue
+                prop, value = [part.strip() for part in declaration.split(':', 1)]
+                if prop.lower() not in properties: continue
+                if value.lower().endswith('!important'):
+                    important[prop.lower()] = value[:-len('!important')].strip()
+                else:
+                    declarations[prop.lower()] = value
+            if not (declarations or important): continue
+
+            for selector in selectors.split(','):
+                match = self.selector_re.match(selector.strip())
+                if not match or not selector.strip(): continue
+                tag = match.group(1) not in (None, '*') and match.group(1) or None
+                parts = re.findall(r'([#.])([\w-]+)', match.group(2))
+                ids = [name for kind, name in parts if kind == '#']
+                classes = set(name for kind, name in parts if kind == '.')
+                if len(ids) > 1: continue
+                specificity = (len(ids), len(classes), tag and 1 or 0)
+                self.rules.append((specificity, len(self.rules), tag, ids and ids[0] or None,
+                                   classes, declarations, important))
+
+    def declarations(self, elem):
+        """ Returns the declarations that apply to elem, as two dicts: the
+            normal ones (which inline style overrides) and the !important ones
+            (which override inline style)
+        """
+        normal, important = {}, {}
+        if not self.rules: return normal, important
+        tag = elem.tag.split('}')[-1]
+        id = elem.get('id')
+        classes = set(elem.get('class', '').split())
+        for specificity, order, rule_tag, rule_id, rule_classes, declarations, important_declarations in self.rules:
+            if rule_tag and rule_tag != tag: continue
+            if rule_id and rule_id != id: continue
+            if not rule_classes <= classes: continue
+            normal.update(declarations)
+            important.update(important_declarations)
+        return normal, important
+
 
 class PixelSnapEffect(inkex.Effect):
     def __init__(self):
         inkex.Effect.__init__(self)
+        self.transform_cache = {}                       # element -> (transform attribute, parsed Affine)
+        self.ancestor_transforms = {}                   # ancestor element -> cumulative transform for its children (see plan_ancestors)
+        self.errors = []                                # every TransformError reported during the run
+        self.style_cache = {}                           # element -> its computed StrokeProperties (see computed_style)
+        self.stylesheet = None                          # the document's <style> rules, parsed when first needed
+        self.stats = NullInstrumentation()              # replaced by an Instrumentation with --profile_report
+        self.misaligned = []                            # (element, check, offset) for each failed check, with --audit
+        self.audited = set()                            # the elements checked so far, with --audit
+        self.density_transform = None                   # scale(k) when snapping for a k-times pixel density (see snap_densities)
+        self.path_cache = None                          # element -> (path data, parsed PathGeometry), while snapping at several densities
+        self.clone_cache = {}                           # (href, clone_class) -> id of the source snapped for it, with --snap_clones
+        self.clone_sources = {}                         # source element -> the clone_class it has been snapped for
+        self.clone_originals = {}                       # source element -> a copy of it from before it was snapped
+        self.clone_copies = []                          # copies of sources made for clones of another clone_class
+        self.id_map = None                              # id -> element, built when first needed (see element_by_id)
+        self.edits = None                               # element -> names of its attributes we've set, with --patch_output
+        self.cache = None                               # the ResultCache, with --cache_file
+        self.deadline = None                            # when to stop snapping, with --time_budget
+        self.deferred = None                            # paths whose nodes are to be snapped last, with --time_budget (see snap_deferred)
+        self.unsnapped = []                             # elements left as they were when we ran out of time
+        self.unshaped = []                              # paths whose nodes were left as they were when we ran out of time
+        self.progress_due = None                        # when to next print our progress, with --progress_interval
         opts = [('-a', 'inkbool', 'snap_ancestors', True,
                  "Snap unselected ancestors' translations (groups, layers, document height) first"),
                 ('-t', 'inkbool', 'ancestor_offset', True,
@@ -181,11 +474,105 @@ class PixelSnapEffect(inkex.Effect):
                  "Modify shapes, size, and positions (valid options: size_only, shape_and_size, position_only)"),
                 ('-g', 'float', 'max_gradient', 0.5,
                  "Maximum slope to consider straight (%)"),
+                ('-r', 'inkbool', 'remember_snaps', False,
+                 "Skip elements that haven't changed since they were last snapped with the same settings"),
+                (None, 'inkbool', 'select_all', False,
+                 "Snap every snappable element in every layer, as well as any given by --id"),
+                (None, 'string', 'select_xpath', '',
+                 "Snap the elements matching this XPath expression, as well as any given by --id"),
+                (None, 'string', 'select_region', '',
+                 "Snap the elements that intersect this rectangle (x,y,width,height in user units), or this artboard (the id or label of an inkscape:page or any other element), as well as any given by --id"),
+                (None, 'inkbool', 'index_cache', False,
+                 "Keep the index of bounding boxes that --select_region searches in FILE.pixelsnap-index, next to the input file, for repeated queries"),
+                (None, 'inkbool', 'compact_paths', False,
+                 "Write snapped paths as compact path data, rounded to --path_digits decimal places"),
+                (None, 'int', 'path_digits', Precision,
+                 "Number of decimal places in compact path data"),
+                (None, 'inkbool', 'relative_paths', False,
+                 "Use relative coordinates in compact path data"),
+                (None, 'inkbool', 'audit', False,
+                 "Don't snap anything, just report the selected elements that aren't pixel-aligned (exit status 1 if any)"),
+                (None, 'inkbool', 'audit_fail_fast', False,
+                 "With --audit, stop at the first element that isn't pixel-aligned"),
+                (None, 'float', 'audit_tolerance', 0.001,
+                 "With --audit, how far off a pixel boundary (in px) still counts as aligned"),
+                (None, 'inkbool', 'snap_clones', False,
+                 "Snap the elements that clones (<use>) refer to, once for each distinct transform they're cloned with"),
+                (None, 'int', 'layer_processes', 1,
+                 "Snap the selection in each top-level layer in a separate worker process, using this many processes (0: one per core)"),
+                (None, 'string', 'densities', '',
+                 "Snap once for each of these comma-separated pixel densities (e.g. 1,2,3), writing NAME@<density>x.svg for each"),
+                (None, 'string', 'density_dir', '',
+                 "Directory to write the --densities files to (default: next to the input file)"),
+                (None, 'inkbool', 'patch_output', False,
+                 "Write the output by patching the changed attributes into a copy of the input file, leaving every other byte alone"),
+                (None, 'string', 'cache_file', '',
+                 "Keep the results of snapping each path & shape in this SQLite file, and reuse them for identical elements in later runs"),
+                (None, 'int', 'cache_size', 100000,
+                 "Most results to keep in --cache_file (the least recently used are dropped first)"),
+                (None, 'float', 'time_budget', 0,
+                 "Stop snapping after this many seconds (0: no limit), leaving the rest as it was. Paths' nodes are snapped last"),
+                (None, 'float', 'progress_interval', 0,
+                 "Print how far we've got to stderr every this many seconds (0: never)"),
+                (None, 'inkbool', 'stream', False,
+                 "Snap the document as it's read, for files too big to hold in memory (with --select_all or --id)"),
+                (None, 'string', 'profile_report', '',
+                 "Write a JSON report of the time spent in each phase, and other counts, to this file ('-' for stderr)"),
                 ]
         for o in opts:
-            self.OptionParser.add_option(o[0], '--'+o[2], action="store", type=o[1],
+            flags = [f for f in (o[0], '--'+o[2]) if f]
+            self.OptionParser.add_option(*flags, action="store", type=o[1],
                                          dest=o[2], default=o[3], help=o[4])
 
+    def set_attribute(self, elem, name, value):
+        """ Every attribute we change is changed here, so that --patch_output
+            knows which ones to write (see write_patched)
+        """
+        elem.set(name, value)
+        if self.edits is not None: self.edits.setdefault(elem, set()).add(name)
+
+    def replace_attributes(self, elem, attrib):
+        """ Replaces all of elem's attributes with attrib, a list of (name,
+            value) in the order they should be in
+        """
+        if self.edits is not None: self.edits.setdefault(elem, set()).update(elem.attrib.keys() + [k for k, v in attrib])
+        elem.attrib.clear()
+        for k, v in attrib: elem.set(k, v)
+
+    def report_error(self, e):
+        self.errors.append(e)
+        self.stats.error(e)
+        print >>sys.stderr, e
+
+    def select(self, elem):
+        self.selected[elem.get('id') or self.document.getpath(elem)] = elem
+
+    def layer_elements(self, parent):
+        """ Yields every snappable element in the layers below parent, like
+            Inkscape's "Select All in All Layers": layers themselves aren't
+            yielded, just descended into.
+        """
+        for elem in parent:
+            if elemtype(elem, 'g') and elem.get(inkex.addNS('groupmode', 'inkscape')) == 'layer':
+                for e in self.layer_elements(elem): yield e
+            elif elemtype(elem, Snappable):
+                yield elem
+
+    def getselected(self):
+        """ As well as the elements given by --id, select those given by
+            --select_xpath and --select_all, for when we're not run from Inkscape
+        """
+        inkex.Effect.getselected(self)
+        if self.options.select_xpath:
+            for elem in self.document.xpath(self.options.select_xpath, namespaces=inkex.NSS):
+                if hasattr(elem, 'tag'): self.select(elem)          # skip any attribute/text results
+        if self.options.select_all:
+            for elem in self.layer_elements(self.document.getroot()):
+                self.select(elem)
+        if self.options.select_region:
+            for elem in pixelsnap_index.region_elements(self, self.options.select_region):
+                self.select(elem)
+
     def vertical(self, pt1, pt2):
         hlen = abs(pt1[0] - pt2[0])
         vlen = abs(pt1[1] - pt2[1])
@@ -213,46 +600,91 @@ class PixelSnapEffect(inkex.Effect):
         if stroke_width == 0: return 0                                          # if there's no stroke, no need to worry about the transform
 
         transform = self.get_transform(elem, parent_transform=parent_transform)
-        if abs(abs(transform[0][0]) - abs(transform[1][1])) > (10**-Precision):
+        if abs(abs(transform.a) - abs(transform.d)) > (10**-Precision):
             raise TransformError("Selection contains non-symetric scaling")     # *** wouldn't be hard to get around this by calculating vertical_offset & horizontal_offset separately, maybe 2 functions, or maybe returning a tuple
 
         stroke_width = transform_dimensions(transform, width=stroke_width)
 
         return (stroke_width/2)
 
+    def computed_style(self, elem):
+        """ Returns a dict of elem's effective StrokeProperties, taking into
+            account (from weakest to strongest) what it inherits from its
+            parent, presentation attributes, <style> rules, its style
+            attribute, and !important rules. Each element is only resolved
+            once; stroke_width() forgets the entry when it changes the style.
+        """
+        style = self.style_cache.get(elem)
+        if style is not None: return style
+
+        parent = elem.getparent()
+        inherited = parent is not None and self.computed_style(parent) or {}
+        if self.stylesheet is None:
+            self.stylesheet = Stylesheet(elem.getroottree().getroot(), StrokeProperties)
+        rules, important = self.stylesheet.declarations(elem)
+        inline = simplestyle.parseStyle(elem.attrib.get('style', ''))
+
+        style = dict(inherited)
+        for declarations in (elem.attrib, rules, inline, important):
+            for prop in StrokeProperties:
+                value = declarations.get(prop)
+                if value is None: continue
+                value = value.strip()
+                if value == 'inherit':
+                    if prop in inherited: style[prop] = inherited[prop]
+                    else: style.pop(prop, None)
+                else:
+                    style[prop] = value
+
+        self.style_cache[elem] = style
+        return style
+
     def stroke_width(self, elem, setval=None):
-        """ Get/set stroke-width in pixels, untransformed
+        """ Get/set stroke-width in pixels, untransformed.
+            The stroke-width we get is the computed one (see computed_style),
+            but we set it in the element's own style attribute.
         """
-        style = simplestyle.parseStyle(elem.attrib.get('style', ''))
-        stroke = style.get('stroke', None)
-        if stroke == 'none': stroke = None
-            
-        stroke_width = 0
-        if stroke and setval is None:
-            stroke_width = unittouu(style.get('stroke-width', '').strip())
-            
         if setval:
+            style = simplestyle.parseStyle(elem.attrib.get('style', ''))
             style['stroke-width'] = str(setval)
-            elem.attrib['style'] = simplestyle.formatStyle(style)
-        else:
-            return stroke_width
+            self.set_attribute(elem, 'style', simplestyle.formatStyle(style))
+            for e in elem.iter():                                               # it & its descendants' computed styles are out of date now
+                self.style_cache.pop(e, None)
+            return
 
-    def set_transform(self, elem, matrix):
-        """ Sets this element's transform value to the given matrix """
-        elem.attrib['transform'] = simpletransform.formatTransform(matrix)
+        style = self.computed_style(elem)
+        stroke = style.get('stroke', None)
+        if stroke == 'none': stroke = None
+
+        stroke_width = 0
+        if stroke:
+            stroke_width = unittouu(style.get('stroke-width', '1'))              # 1 is the default stroke-width
+        return stroke_width
+
+    def set_transform(self, elem, transform):
+        """ Sets this element's transform value to the given Affine """
+        value = simpletransform.formatTransform(transform.to_matrix())
+        if elem in self.ancestor_transforms and elem.attrib.get('transform') != value:
+            self.ancestor_transforms.clear()                    # the planned transforms below this element are out of date
+        self.set_attribute(elem, 'transform', value)
+        self.transform_cache.pop(elem, None)                    # read it back as written, i.e. at the precision formatTransform gives it
 
     def get_transform(self, elem, parent_transform=None):
-        """ Get this element's transform as a matrix. If parent_transform is
+        """ Get this element's transform as an Affine. If parent_transform is
             specified, return the cumulative transform.
         """
-        transform = elem.attrib.get('transform', '').strip()
-        
-        if transform:
-            transform = simpletransform.parseTransform(transform)
+        attr = elem.attrib.get('transform', '')
+        cached = self.transform_cache.get(elem)
+        if cached is not None and cached[0] == attr:
+            transform = cached[1]
         else:
-            transform = [[1,0,0], [0,1,0], [0,0,1]]
+            if attr.strip():
+                transform = Affine.from_matrix(simpletransform.parseTransform(attr.strip()))
+            else:
+                transform = Affine()
+            self.transform_cache[elem] = attr, transform
         if parent_transform:
-            transform = simpletransform.composeTransform(parent_transform, transform)
+            transform = parent_transform.compose(transform)
             
         return transform
 
@@ -260,63 +692,77 @@ class PixelSnapEffect(inkex.Effect):
         """ Returns the cumulative transform of all this element's ancestors
             (excluding this element's own transform)
         """
-        transform = [[1,0,0], [0,1,0], [0,0,1]]
+        transform = Affine()
         for a in self.ancestors(elem):
-            transform = simpletransform.composeTransform(transform, self.get_transform(a))
+            transform = transform.compose(self.get_transform(a))
         return transform
 
     def transform_path_node(self, transform, path, i):
         """ Modifies a node so that every point is transformed, including handles
         """
-        segtype = path[i][0].lower()
-        
-        if segtype == 'z': return
-        elif segtype == 'h':
-            path[i][1][0] = transform_point(transform, [path[i][1][0], 0])[0]
-        elif segtype == 'v':
-            path[i][1][0] = transform_point(transform, [0, path[i][1][0]])[1]
-        else:
-            first_coordinate = 0
-            if (segtype == 'a'): first_coordinate = 5           # for elliptical arcs, skip the radius x/y, rotation, large-arc, and sweep
-            for j in range(first_coordinate, len(path[i][1]), 2):
-                x, y = path[i][1][j], path[i][1][j+1]
-                x, y = transform_point(transform, (x, y))
-                path[i][1][j] = x
-                path[i][1][j+1] = y
-        
+        start, end = path.offsets[i], path.offsets[i+1]
+        path.points[start:end] = transform.apply_array(path.points[start:end])
     
     def pathxy(self, path, i, setval=None):
         """ Get/set the endpoint of the given path segment.
-            Inspects the segment type to know which elements are the endpoints.
-
-            *** we don't treat 'z' segments correctly, meaning that this doesn't work
-            right for paths with multiple subpaths.
+            A 'z' segment's endpoint is the start of its own subpath.
         """
-        segtype = path[i][0].lower()
-        x = y = 0
-
-        if segtype == 'z':                          # Return to start of current subpath -- final point == first point
-            while path[i][0].lower() != 'm' and i != 0:
-                i -= 1
+        i = path.endpoint_index(i)
+        if setval:                                  # We still modify "return to origin" points (segtype=='z'), even though they're equal to the first point
+            path.points[i] = setval[0], setval[1]
+        else:
+            return path.points[i].tolist()
 
-        if segtype == 'h':                          # Horizontal segment
-            if setval: path[i][1][0] = setval[0]
-            else: x = path[i][1][0]
-            
-        elif segtype == 'v':                        # Vertical segment 
-            if setval: path[i][1][0] = setval[1]
-            else: y = path[i][1][0]
+    def path_geometry(self, elem):
+        """ Parses the element's path data, once, to be shared by each of the
+            snap_path_* stages. The points of a <polyline> or <polygon>, and
+            the ends of a <line>, are read straight into a PathGeometry.
+        """
+        # If we have a Live Path Effect, modify original-d. If anyone clamours
+        # for it, we could make an option to ignore paths with Live Path Effects
+        if elemtype(elem, 'path'):
+            original_d = '{%s}original-d' % inkex.NSS['inkscape']
+            d = elem.attrib.get(original_d, elem.attrib['d'])
+        elif elemtype(elem, 'line'):
+            d = tuple(unittouu(elem.get(attr, '0')) for attr in ('x1', 'y1', 'x2', 'y2'))
         else:
-            if setval:                              # We still modify "return to origin" points (segtype=='z'), even though they're equal to the first point
-                path[i][1][-2] = setval[0]
-                path[i][1][-1] = setval[1]
+            d = elem.get('points', '')
+        if self.path_cache is None:
+            return self.parse_geometry(elem, d)
+
+        cached = self.path_cache.get(elem)                  # snapping at several densities: parse each path once, snap copies
+        if cached is None or cached[0] != d:
+            cached = self.path_cache[elem] = d, self.parse_geometry(elem, d)
+        return cached[1].copy()
+
+    def parse_geometry(self, elem, d):
+        if elemtype(elem, 'path'):
+            return pixelsnap_path.PathGeometry(simplepath.parsePath(d))
+        if elemtype(elem, 'line'):
+            return pixelsnap_path.PathGeometry.from_points(d)
+        points = numpy.fromstring(d.replace(',', ' '), sep=' ')
+        points = points[:len(points) // 2 * 2]                     # an odd coordinate out is an error, and isn't drawn
+        return pixelsnap_path.PathGeometry.from_points(points, closed=elemtype(elem, 'polygon'))
+
+    def write_path(self, elem, path):
+        """ Writes the (modified) path back to the element """
+        if elemtype(elem, ('polyline', 'polygon', 'line')):
+            numbers = [format_number(v, self.options.path_digits) for v in path.points.ravel().tolist()]
+            if elemtype(elem, 'line'):
+                for attr, value in zip(('x1', 'y1', 'x2', 'y2'), numbers): self.set_attribute(elem, attr, value)
             else:
-                x = path[i][1][-2]                  # Ordinary point
-                y = path[i][1][-1]
+                self.set_attribute(elem, 'points', ' '.join(['%s,%s' % xy for xy in zip(numbers[::2], numbers[1::2])]))
+            return
 
-        if setval is None: return [x, y]
+        original_d = '{%s}original-d' % inkex.NSS['inkscape']
+        if self.options.compact_paths:
+            d = path.format(self.options.path_digits, self.options.relative_paths)
+        else:
+            d = simplepath.formatPath(path.to_path())
+        if original_d in elem.attrib: self.set_attribute(elem, original_d, d)
+        else: self.set_attribute(elem, 'd', d)
     
-    def path_bounding_box(self, elem, parent_transform=None, stroke_width=True):
+    def path_bounding_box(self, elem, parent_transform=None, stroke_width=True, path=None):
         """ Returns [min_x, min_y], [max_x, max_y] of the transformed
             element. (It doesn't make any sense to return the untransformed
             bounding box, with the intent of transforming it later, because
@@ -325,31 +771,20 @@ class PixelSnapEffect(inkex.Effect):
             If stroke_width=True (default), the returned bounding box includes
             stroke-width offset.
             
-            This function uses a simplistic algorithm & doesn't take curves
-            or arcs into account, just node positions.
+            This takes the true extents of curves & arcs into account, not
+            just node positions (see PathGeometry.bounding_box).
+
+            If the path has already been parsed, pass it in as path.
         """
-        # If we have a Live Path Effect, modify original-d. If anyone clamours
-        # for it, we could make an option to ignore paths with Live Path Effects
-        original_d = '{%s}original-d' % inkex.NSS['inkscape']
-        path = simplepath.parsePath(elem.attrib.get(original_d, elem.attrib['d']))
+        if path is None: path = self.path_geometry(elem)
 
         transform = self.get_transform(elem, parent_transform)
         if stroke_width: offset = self.stroke_width_offset(elem, parent_transform)
         else: offset = 0
-        
-        min_x = min_y = max_x = max_y = 0
-        for i in range(len(path)):
-            x, y = self.pathxy(path, i)
-            x, y = transform_point(transform, (x, y))
-            
-            if i == 0:
-                min_x = max_x = x
-                min_y = max_y = y
-            else:
-                min_x = min(x, min_x)
-                min_y = min(y, min_y)
-                max_x = max(x, max_x)
-                max_y = max(y, max_y)
+
+        bbox = path.bounding_box(transform)
+        if bbox is None: bbox = (0, 0), (0, 0)
+        (min_x, min_y), (max_x, max_y) = bbox
         
         return (min_x-offset, min_y-offset), (max_x+offset, max_y+offset)
     
@@ -358,11 +793,11 @@ class PixelSnapEffect(inkex.Effect):
         # Doesn't take any parent_transform into account -- assumes
         # that the parent's transform has already been snapped.
         transform = self.get_transform(elem)
-        if transform[0][1] or transform[1][0]:             # if we've got any skew/rotation, get outta here
+        if transform.skewed():                          # if we've got any skew/rotation, get outta here
             raise TransformError("Selection contains transformations with skew/rotation")
  
-        transform[0][2] = round(transform[0][2])
-        transform[1][2] = round(transform[1][2])
+        transform = Affine(transform.a, transform.b, transform.c, transform.d,
+                           round(transform.e), round(transform.f))
         
         self.set_transform(elem, transform)
     
@@ -372,7 +807,7 @@ class PixelSnapEffect(inkex.Effect):
         stroke_width = self.stroke_width(elem)
         if (stroke_width == 0): return                                          # no point raising a TransformError if there's no stroke to snap
 
-        if abs(abs(transform[0][0]) - abs(transform[1][1])) > (10**-Precision):
+        if abs(abs(transform.a) - abs(transform.d)) > (10**-Precision):
             raise TransformError("Selection contains non-symetric scaling, can't snap stroke width")
         
         if stroke_width:
@@ -381,18 +816,16 @@ class PixelSnapEffect(inkex.Effect):
             stroke_width = transform_dimensions(transform, width=stroke_width, inverse=True)
             self.stroke_width(elem, stroke_width)
 
-    def snap_path_scale(self, elem, parent_transform=None):
+    def snap_path_scale(self, elem, parent_transform=None, path=None):
         """ Goes through each node in the given path and modifies it as
             necessary in order to scale the entire path by the required
             (calculated) factor.
         """
-    
-        # If we have a Live Path Effect, modify original-d. If anyone clamours
-        # for it, we could make an option to ignore paths with Live Path Effects
-        original_d = '{%s}original-d' % inkex.NSS['inkscape']
-        path = simplepath.parsePath(elem.attrib.get(original_d, elem.attrib['d']))
+
+        own_path = path is None                             # if we're not given a parsed path, we're responsible for writing it back
+        if own_path: path = self.path_geometry(elem)
         transform = self.get_transform(elem, parent_transform)
-        min_xy, max_xy = self.path_bounding_box(elem, parent_transform)
+        min_xy, max_xy = self.path_bounding_box(elem, parent_transform, path=path)
         
         width = max_xy[0] - min_xy[0]
         height = max_xy[1] - min_xy[1]
@@ -407,295 +840,104 @@ class PixelSnapEffect(inkex.Effect):
         min_xy = transform_point(transform, min_xy, inverse=True)
         max_xy = transform_point(transform, max_xy, inverse=True)
 
-        for i in range(len(path)):
-            self.transform_path_node([[1, 0, -min_xy[0]], [0, 1, -min_xy[1]]], path, i)     # Center transform
-            self.transform_path_node([[rescale[0], 0, 0],                                   # Perform scaling
-                                       [0, rescale[1], 0]],
-                                       path, i)
-            self.transform_path_node([[1, 0, +min_xy[0]], [0, 1, +min_xy[1]]], path, i)     # Uncenter transform
+        path.scale(rescale[0], rescale[1], origin=min_xy)                                   # Center, scale & uncenter in one go
         
-        path = simplepath.formatPath(path)
-        if original_d in elem.attrib: elem.attrib[original_d] = path
-        else: elem.attrib['d'] = path
+        if own_path: self.write_path(elem, path)
 
-    def snap_path_pos(self, elem, parent_transform=None):
+    def snap_path_pos(self, elem, parent_transform=None, path=None):
         """ Goes through each node in the given path and modifies it as
             necessary in order to shift the entire path by the required
             (calculated) distance.
         """
 
-        # If we have a Live Path Effect, modify original-d. If anyone clamours
-        # for it, we could make an option to ignore paths with Live Path Effects
-        original_d = '{%s}original-d' % inkex.NSS['inkscape']
-        path = simplepath.parsePath(elem.attrib.get(original_d, elem.attrib['d']))
+        own_path = path is None
+        if own_path: path = self.path_geometry(elem)
         transform = self.get_transform(elem, parent_transform)
-        min_xy, max_xy = self.path_bounding_box(elem, parent_transform)
+        min_xy, max_xy = self.path_bounding_box(elem, parent_transform, path=path)
 
         fractional_offset = min_xy[0]-round(min_xy[0]), min_xy[1]-round(min_xy[1])-self.document_offset
         fractional_offset = transform_dimensions(transform, fractional_offset[0], fractional_offset[1], inverse=True)
 
-        for i in range(len(path)):
-            self.transform_path_node([[1, 0, -fractional_offset[0]],
-                                       [0, 1, -fractional_offset[1]]],
-                                       path, i)
+        path.translate(-fractional_offset[0], -fractional_offset[1])
 
-        path = simplepath.formatPath(path)
-        if original_d in elem.attrib: elem.attrib[original_d] = path
-        else: elem.attrib['d'] = path
+        if own_path: self.write_path(elem, path)
 
-    def snap_path_intent(self, elem, parent_transform=None):
-        """ Like snap_path_shape, but preserves widths, making it much better
-            for delicate shapes like fonts (ideally this could act like an auto
-            hinting algorithm). The idea is to obselete the original snap_path_shape
-            altogether.
-            
-            We assume the position of the path has already been snapped to
-            a pixel boundary (i.e. we calculate all widths relative to the edge
-            of the path).
-            
-            Note: to preserve shape in some special cases (eg very thin font
-            strokes) any widths that snap to 0 we should snap to 0.5, but calculate
-            the subsequent width relative to the previous segment.
+    def snap_path_intent(self, elem, parent_transform=None, path=None):
+        """ Snaps the nodes of a path so that its straight vertical &
+            horizontal segments land on pixel boundaries, keeping its widths
+            (see pixelsnap_shape)
         """
-        class Node(object):
-            def __init__(self, **kwargs):
-                for k,v in kwargs.iteritems(): setattr(self, k, v)
-        
-        # If we have a Live Path Effect, modify original-d. If anyone clamours
-        # for it, we could make an option to ignore paths with Live Path Effects
-        original_d = '{%s}original-d' % inkex.NSS['inkscape']
-        path = simplepath.parsePath(elem.attrib.get(original_d, elem.attrib['d']))
-
-        transform = self.get_transform(elem, parent_transform)
-
-        if transform[0][1] or transform[1][0]:          # if we've got any skew/rotation, get outta here
-            raise TransformError("Selection contains transformations with skew/rotation")
-        
-        offset = self.stroke_width_offset(elem, parent_transform) % 1
-
-        # First, create our own list of the path's nodes, to keep track of various useful info for each node.
-        # This list will include the endpoint node (which equals the first node) for a closed path
-        nodes = [ Node(untransformed=self.pathxy(path, i), index=i) for i in range(len(path)) ]
+        pixelsnap_shape.snap_path_intent(self, elem, parent_transform, path)
 
-        # Then calculate the transformed location for each node
-        for node in nodes:
-            node.transformed = tuple(transform_point(transform, node.untransformed))
-        
-        # Now mark whether it's a vertical or horizontal segment, find the
-        # next node in the segment, and set some other useful properties
-        for node in nodes:
-            node.next = nodes[(node.index+1) % len(nodes)]
-            node.vertical = node.next.on_vertical = self.vertical(node.transformed, node.next.transformed)
-            node.horizontal = node.next.on_horizontal= self.horizontal(node.transformed, node.next.transformed)
-            node.vertical_direction = node.transformed[1] - node.next.transformed[1]
-            node.horizontal_direction = node.transformed[0] - node.next.transformed[0]
-            node.snapped = list(node.transformed)
-        
-        # Create an ordered list of all segments, ordered by horizontal position,
-        # and another ordered by vertical position.
-        horizontals = sorted(nodes, key=lambda node: node.transformed[1])
-        verticals = sorted(nodes, key=lambda node: node.transformed[0])
-
-        # Calculate the distance of each segment relative to the previous.
-        # If segments are the same direction, allow snapping to zero width,
-        # otherwise don't snap when < 0.5. If we didn't snap, calculate distance
-        # of the next segment relative to the previous segment
-        prev_segment = None
-        for node in verticals:
-            if not node.vertical: continue
-            if prev_segment:
-                node.distance = node.transformed[0] - prev_segment.transformed[0]
-                if node.vertical_direction != prev_segment.vertical_direction and abs(node.distance) < 0.5:
-                    node.vertical = False       # Pretend it's not straight after this
-                    node.next.on_vertical = False
-                    continue
-                prev_segment.next_vertical = node
-                node.snapped_distance = round(node.distance)
-                node.snapped[0] = prev_segment.snapped[0] + node.snapped_distance
-
-            # Set them equal so that almost-vertical lines (slope < max_gradient)
-            # are certain to be made straight. Also, do it in every case, whether
-            # or not this is the first segment (no prev_segment), because sometimes
-            # first segments could be almost-vertical
-            node.next.snapped[0] = node.snapped[0]
-            prev_segment = node
-
-        prev_segment = None
-        for node in horizontals:
-            if not node.horizontal: continue
-            if prev_segment:
-                node.distance = node.transformed[1] - prev_segment.transformed[1]
-                if node.horizontal_direction != prev_segment.horizontal_direction and abs(node.distance) < 0.5:
-                    node.horizontal = False     # Pretend it's not straight after this
-                    node.next.on_horizontal = False
-                    continue
-                prev_segment.next_horizontal = node
-                node.snapped_distance = round(node.distance)
-                node.snapped[1] = prev_segment.snapped[1] + node.snapped_distance
-            
-            # See comment above re almost-vertical
-            node.next.snapped[1] = node.snapped[1]
-            prev_segment = node
-
-        # Go through the in-between nodes and distribute each one between the
-        # segments, according to the amount we've shifted the segments
-        current_offset = {'origin': 0, 'shift': 0, 'scale': 1}
-        for node in verticals:
-            if node.on_vertical: continue
-            if node.vertical:
-                current_offset['origin'] = node.transformed[0]
-                current_offset['shift'] = node.snapped[0] - node.transformed[0]
-                if hasattr(node, 'next_vertical') and node.next_vertical.distance:
-                    current_offset['scale'] = node.next_vertical.snapped_distance / node.next_vertical.distance
-                else:
-                    current_offset['scale'] = 1
-                continue
-            node.snapped[0] = (node.snapped[0] - current_offset['origin']) * current_offset['scale'] + current_offset['origin'] + current_offset['shift']
-
-        current_offset = {'origin': 0, 'shift': 0, 'scale': 1}
-        for node in horizontals:
-            if node.on_horizontal: continue
-            if node.horizontal:
-                current_offset['origin'] = node.transformed[1]
-                current_offset['shift'] = node.snapped[1] - node.transformed[1]
-                if hasattr(node, 'next_horizontal') and node.next_horizontal.distance:
-                    current_offset['scale'] = node.next_horizontal.snapped_distance / node.next_horizontal.distance
-                else:
-                    current_offset['scale'] = 1
-                continue
-            node.snapped[1] = (node.snapped[1] - current_offset['origin']) * current_offset['scale'] + current_offset['origin'] + current_offset['shift']
-
-        # Calculate the distance required to snap the first horizontal & vertical
-        # segments to a pixel, and shift the whole path accordingly.
-        # (Like snap_path_pos, but relative to the first straight segment, not
-        # the bounding box)
-        # Incidentally, the .snapped and .transformed attributes of the first
-        # straight segment are identical at this point.
-        
-        stroke_offset = self.stroke_width_offset(elem, parent_transform)
-        x_offset = 0
-        y_offset = 0
-        for node in horizontals:
-            if node.horizontal:
-                y_offset = round(node.snapped[1]) - node.snapped[1] + self.document_offset
-                break
-        for node in verticals:
-            if node.vertical:
-                x_offset = round(node.snapped[0]) - node.snapped[0]
-                break
-        
-        for node in nodes:
-            node.snapped[0] += x_offset + stroke_offset
-            node.snapped[1] += y_offset + stroke_offset
-
-        # Finally go through each altered node and modify the actual path
-        for node in nodes:
-            fractional_offset = node.snapped[0]-node.transformed[0], node.snapped[1]-node.transformed[1]
-            fractional_offset = transform_dimensions(transform, fractional_offset[0], fractional_offset[1], inverse=True)
-            self.transform_path_node([[1, 0, fractional_offset[0]],
-                           [0, 1, fractional_offset[1]]],
-                           path, node.index)
-
-        path = simplepath.formatPath(path)
-        if original_d in elem.attrib: elem.attrib[original_d] = path
-        else: elem.attrib['d'] = path
-
-    def snap_path_shape(self, elem, parent_transform=None):
-        """ Goes through each node in the given path and shifts it to the
-            nearest pixel boundary. This would normally be done after
-            the path is shifted & scaled into position, to make sure the
-            least intrusive modifications are done first -- often the shape
-            won't need to be snapped at all, if a shift/scale was successful.
+    def snap_path_shape(self, elem, parent_transform=None, path=None):
+        """ The original node-by-node version of snap_path_intent (see
+            pixelsnap_shape)
         """
+        pixelsnap_shape.snap_path_shape(self, elem, parent_transform, path)
 
-        # If we have a Live Path Effect, modify original-d. If anyone clamours
-        # for it, we could make an option to ignore paths with Live Path Effects
-        original_d = '{%s}original-d' % inkex.NSS['inkscape']
-        path = simplepath.parsePath(elem.attrib.get(original_d, elem.attrib['d']))
-
-        transform = self.get_transform(elem, parent_transform)
+    def snap_path(self, elem, parent_transform=None):
+        # The path is parsed once here, shared by each stage, and written back once at the end
+        with self.stats.phase('parse'):
+            path = self.path_geometry(elem)
 
-        if transform[0][1] or transform[1][0]:          # if we've got any skew/rotation, get outta here
-            raise TransformError("Selection contains transformations with skew/rotation")
-        
-        offset = self.stroke_width_offset(elem, parent_transform) % 1
-        
-        prev_xy = self.pathxy(path, -1)
-        first_xy = self.pathxy(path, 0)
-        for i in range(len(path)):
-            xy = self.pathxy(path, i)
-            if (i == len(path)-1) or \
-               ((i == len(path)-2) and path[-1][0].lower() == 'z'):
-                next_xy = first_xy
-            else:
-                next_xy = self.pathxy(path, i+1)
-            
-            if not (xy and prev_xy and next_xy):
-                print >>sys.stderr, "xy=%s, prev_xy=%s, next_xy=%" % (xy, prev_xy, next_xy)
-                prev_xy = xy
-                continue
-            
-            xy_untransformed = tuple(xy)
-            xy = list(transform_point(transform, xy))
-            prev_xy = transform_point(transform, prev_xy)
-            next_xy = transform_point(transform, next_xy)
-            
-            on_vertical = on_horizontal = False
-            
-            if self.horizontal(xy, prev_xy):
-                if len(path) > 2 or i==0:                   # on 2-point paths, first.next==first.prev==last and last.next==last.prev==first
-                    xy[1] = prev_xy[1]                      # make the almost-equal values equal, so they round in the same direction
-                on_horizontal = True
-            if self.horizontal(xy, next_xy):
-                on_horizontal = True
-            
-            if self.vertical(xy, prev_xy):                       # as above
-                if len(path) > 2 or i==0:
-                    xy[0] = prev_xy[0]
-                on_vertical = True
-            if self.vertical(xy, next_xy):
-                on_vertical = True
-
-            prev_xy = tuple(xy_untransformed)
-            
-            fractional_offset = [0,0]
-            if on_vertical:
-                fractional_offset[0] = xy[0] - (round(xy[0]-offset) + offset)
-            if on_horizontal:
-                fractional_offset[1] = xy[1] - (round(xy[1]-offset) + offset) - self.document_offset
-            
-            fractional_offset = transform_dimensions(transform, fractional_offset[0], fractional_offset[1], inverse=True)
-            self.transform_path_node([[1, 0, -fractional_offset[0]],
-                                       [0, 1, -fractional_offset[1]]],
-                                       path, i)
+        # we always modify at least the position, no matter what option they choose
+        if self.options.modify_shapes == 'size_and_position':
+            with self.stats.phase('snap_path_pos'):
+                self.snap_path_pos(elem, parent_transform, path)
+            with self.stats.phase('snap_path_scale'):
+                self.snap_path_scale(elem, parent_transform, path)
 
+        elif self.options.modify_shapes == 'shape':
+            with self.stats.phase('snap_path_intent'):
+                #self.snap_path_shape(elem, parent_transform, path)
+                self.snap_path_intent(elem, parent_transform, path)
 
-        path = simplepath.formatPath(path)
-        if original_d in elem.attrib: elem.attrib[original_d] = path
-        else: elem.attrib['d'] = path
+        else: return
 
-    def snap_path(self, elem, parent_transform=None):
-        # we always modify at least the position, no matter what option they choose
-        if self.options.modify_shapes == 'size_and_position':
-            self.snap_path_pos(elem, parent_transform)
-            self.snap_path_scale(elem, parent_transform)
+        self.stats.count('nodes transformed', len(path))
+        with self.stats.phase('write'):
+            self.write_path(elem, path)
 
-        if self.options.modify_shapes == 'shape':
-            #self.snap_path_shape(elem, parent_transform)
-            self.snap_path_intent(elem, parent_transform)
+    def box(self, elem):
+        """ Returns x, y, width, height of a rect or image, or of the box
+            around a circle or ellipse
+        """
+        if elemtype(elem, ('circle', 'ellipse')):
+            cx, cy = unittouu(elem.get('cx', '0')), unittouu(elem.get('cy', '0'))
+            if elemtype(elem, 'circle'): rx = ry = unittouu(elem.get('r', '0'))
+            else: rx, ry = unittouu(elem.get('rx', '0')), unittouu(elem.get('ry', '0'))
+            return cx - rx, cy - ry, 2*rx, 2*ry
+        return unittouu(elem.attrib['x']), unittouu(elem.attrib['y']), \
+               unittouu(elem.attrib['width']), unittouu(elem.attrib['height'])
+
+    def set_box(self, elem, x, y, width, height):
+        """ Moves & resizes elem to the given box (see box) """
+        if elemtype(elem, 'circle'):
+            if abs(width - height) > (10**-Precision):
+                raise TransformError("Selection contains non-symetric scaling, can't snap circle")
+            self.set_attribute(elem, 'cx', str(x + width/2))
+            self.set_attribute(elem, 'cy', str(y + height/2))
+            self.set_attribute(elem, 'r', str(width/2))
+        elif elemtype(elem, 'ellipse'):
+            self.set_attribute(elem, 'cx', str(x + width/2))
+            self.set_attribute(elem, 'cy', str(y + height/2))
+            self.set_attribute(elem, 'rx', str(width/2))
+            self.set_attribute(elem, 'ry', str(height/2))
+        else:
+            self.set_attribute(elem, 'width', str(width))
+            self.set_attribute(elem, 'height', str(height))
+            self.set_attribute(elem, 'x', str(x))
+            self.set_attribute(elem, 'y', str(y))
 
     def snap_rect(self, elem, parent_transform=None):
         transform = self.get_transform(elem, parent_transform)
         
-        if transform[0][1] or transform[1][0]:          # if we've got any skew/rotation, get outta here
+        if transform.skewed():                          # if we've got any skew/rotation, get outta here
             raise TransformError("Selection contains transformations with skew/rotation")
         
         offset = self.stroke_width_offset(elem, parent_transform) % 1
 
-        width = unittouu(elem.attrib['width'])
-        height = unittouu(elem.attrib['height'])
-        x = unittouu(elem.attrib['x'])
-        y = unittouu(elem.attrib['y'])
+        x, y, width, height = self.box(elem)
 
         width, height = transform_dimensions(transform, width, height)
         x, y = transform_point(transform, [x, y])
@@ -709,25 +951,30 @@ class PixelSnapEffect(inkex.Effect):
         width, height = transform_dimensions(transform, width, height, inverse=True)
         x, y = transform_point(transform, [x, y], inverse=True)
         
-        y += self.document_offset/transform[1][1]
+        y += self.document_offset/transform.d
         
         # Position the elem at the newly calculate values
-        elem.attrib['width'] = str(width)
-        elem.attrib['height'] = str(height)
-        elem.attrib['x'] = str(x)
-        elem.attrib['y'] = str(y)
+        self.set_box(elem, x, y, width, height)
     
     def snap_image(self, elem, parent_transform=None):
         self.snap_rect(elem, parent_transform)
 
+    def snap_ellipse(self, elem, parent_transform=None):
+        self.snap_rect(elem, parent_transform)                  # circles & ellipses are snapped by their bounding box
+
     def snap_group(self, elem, parent_transform=None):
         group_transform = self.get_transform(elem, parent_transform)
         for e in elem:
             try:
                 self.snap_object(e, parent_transform=group_transform)
             except TransformError, e:
-                print >>sys.stderr, e
+                self.report_error(e)
     
+    def element_by_id(self, id):
+        if self.id_map is None:
+            self.id_map = dict((e.get('id'), e) for e in self.document.getroot().iter() if e.get('id'))
+        return self.id_map.get(id)
+
     def ancestors(self, elem):
         """ Returns all ancestors of the given element, in a list ordered from
             outermost to innermost. Does not include the element itself
@@ -737,33 +984,249 @@ class PixelSnapEffect(inkex.Effect):
         ancestors.reverse()
         return ancestors
         
+    def plan_ancestors(self, elems):
+        """ Snaps the translation of every distinct ancestor of the given
+            elements exactly once, from outermost to innermost, and remembers
+            each ancestor's cumulative transform (including its own) so that
+            snap_object can look up a parent_transform without walking back
+            up to the root for every selected element.
+
+            If an ancestor can't be snapped, the TransformError is remembered
+            in place of the transform for it & everything below it.
+        """
+        for elem in elems:
+            chain = []                                                  # ancestors we haven't planned yet, innermost first
+            a = elem.getparent()
+            while a is not None and a not in self.ancestor_transforms:
+                chain.append(a)
+                a = a.getparent()
+
+            transform = self.ancestor_transforms.get(a, self.density_transform or Affine())
+            for a in reversed(chain):
+                if not isinstance(transform, TransformError):
+                    try:
+                        if self.options.snap_ancestors and not self.options.audit: self.snap_translation(a)
+                        transform = self.get_transform(a, transform)
+                    except TransformError, e:
+                        transform = e
+                self.ancestor_transforms[a] = transform
+
+    def declare_namespace(self, root):
+        """ Declares the pixelsnap namespace on the root element, so that
+            the fingerprints written below it share the one declaration
+            rather than each declaring it
+        """
+        if PixelSnapNS in root.nsmap.values(): return
+        root.set(FingerprintAttr, '')                   # lxml keeps the declaration it makes for this
+        del root.attrib[FingerprintAttr]
+
+    def fingerprint(self, elem, context_transform):
+        """ Returns a compact hash of everything that snapping the element
+            depends on: its own attributes (geometry, transform & style), its
+            computed stroke width, the transform of its ancestors, and the
+            SnapSettings used. If this matches the FingerprintAttr stored on
+            the element, nothing has changed since it was last snapped.
+        """
+        attrs = sorted((k, v) for k, v in elem.attrib.iteritems() if k != FingerprintAttr)
+        state = (attrs, self.stroke_width(elem), context_transform, self.document_offset,
+                 [getattr(self.options, name) for name in SnapSettings])
+        return hashlib.sha1(repr(state)).hexdigest()[:16]
+
+    def result_key(self, elem, context_transform, parent_transform):
+        """ Returns the key of the result of snapping elem in the ResultCache:
+            a hash of the same things as its fingerprint, less the
+            UncachedAttributes, plus the transform it's snapped relative to.
+        """
+        attrs = sorted((k, v) for k, v in elem.attrib.iteritems() if k not in UncachedAttributes)
+        state = (ResultVersion, elem.tag, attrs, self.stroke_width(elem), context_transform, parent_transform,
+                 self.document_offset, [getattr(self.options, name) for name in SnapSettings])
+        return hashlib.sha1(repr(state)).hexdigest()
+
+    def parent_transforms(self, elem, parent_transform=None):
+        """ Returns (parent_transform, context_transform) for snapping elem:
+            what to snap it relative to, and the transform of everything
+            above it (which its fingerprint depends on).
+        """
+        context_transform = parent_transform
+        if parent_transform is None:                                    # If we've been given a parent_transform, we can assume that the parents have already been snapped, or don't need to be
+            parent = elem.getparent()
+            if parent is not None and parent not in self.ancestor_transforms:
+                self.plan_ancestors([elem])
+            ancestor_transform = context_transform = self.ancestor_transforms.get(parent)
+            if isinstance(ancestor_transform, TransformError): raise ancestor_transform
+            if self.options.ancestor_offset:                            # If we haven't been given a parent_transform, then we need to calculate it
+                parent_transform = ancestor_transform
+            else:
+                parent_transform = self.density_transform
+        return parent_transform, context_transform
+
     def snap_object(self, elem, parent_transform=None):
-        if not elemtype(elem, ('path', 'rect', 'image', 'g', 'use')):
+        if not elemtype(elem, Snappable):
+            if self.stats.enabled:
+                self.stats.count('skipped %s' % (isinstance(elem.tag, basestring) and elem.tag.split('}')[-1] or 'comment'))
             return
-        
-        if self.options.snap_ancestors and parent_transform==None:      # If we've been given a parent_transform, we can assume that the parents have already been snapped, or don't need to be
-            for a in self.ancestors(elem):                              # Loop through ancestors from outermost to innermost, excluding this element.
-                self.snap_translation(a)
-
-        if self.options.ancestor_offset and parent_transform==None:     # If we haven't been given a parent_transform, then we need to calculate it
-            parent_transform = self.get_ancestor_transform(elem)
-
-        self.snap_translation(elem)
+        if self.deadline is not None and time.time() > self.deadline:
+            self.unsnapped.append(elem)
+            return
+        self.stats.count('elements visited')
+        parent_transform, context_transform = self.parent_transforms(elem, parent_transform)
+
+        # Groups are never skipped: their children are fingerprinted individually.
+        # Nor are clones whose sources we snap, as their fingerprint doesn't cover the source
+        remember = self.options.remember_snaps and not elemtype(elem, 'g') and not (self.options.snap_clones and elemtype(elem, 'use'))
+        if remember and FingerprintAttr in elem.attrib:
+            if elem.attrib[FingerprintAttr] == self.fingerprint(elem, context_transform):
+                self.stats.count('skipped unchanged')
+                return
+        errors = len(self.errors)
+
+        key = before = None
+        if self.cache is not None and elemtype(elem, PathElements + BoxElements):
+            key = self.result_key(elem, context_transform, parent_transform)
+            snapped = self.cache.get(key)
+            if snapped is not None:
+                self.stats.count('cache hits')
+                for name, value in snapped: self.set_attribute(elem, name, value)
+                self.style_cache.pop(elem, None)
+                if remember: self.set_attribute(elem, FingerprintAttr, self.fingerprint(elem, context_transform))
+                return
+            self.stats.count('cache misses')
+            before = dict(elem.attrib)
+
+        with self.stats.phase('snap_translation'):
+            self.snap_translation(elem)
 
         if not elemtype(elem, 'g'):
             try:
-                self.snap_stroke(elem, parent_transform)
+                with self.stats.phase('snap_stroke'):
+                    self.snap_stroke(elem, parent_transform)
             except TransformError, e:
-                print >>sys.stderr, e
+                self.report_error(e)
 
-        if elemtype(elem, 'use'):       return                                  # We only snap the position of clones, nothing else to snap.
+        if elemtype(elem, 'use'):                                               # Unless we're snapping what they refer to, we only snap the position of clones
+            if self.options.snap_clones: pixelsnap_clones.snap_clone(self, elem, parent_transform)
         elif elemtype(elem, 'g'):       self.snap_group(elem, parent_transform)
-        elif elemtype(elem, 'path'):    self.snap_path(elem, parent_transform)
-        elif elemtype(elem, 'rect'):    self.snap_rect(elem, parent_transform)
-        elif elemtype(elem, 'image'):   self.snap_image(elem, parent_transform)
+        elif elemtype(elem, PathElements):
+            if self.deferred is not None:                                       # the nodes are snapped once everything else has been
+                ok = len(self.errors) == errors
+                self.deferred.append((elem, parent_transform, context_transform, remember and ok, ok and key, before))
+                return
+            self.snap_path(elem, parent_transform)
+        elif elemtype(elem, 'rect'):
+            with self.stats.phase('snap_rect'):
+                self.snap_rect(elem, parent_transform)
+        elif elemtype(elem, 'image'):
+            with self.stats.phase('snap_rect'):
+                self.snap_image(elem, parent_transform)
+        elif elemtype(elem, ('circle', 'ellipse')):
+            with self.stats.phase('snap_rect'):
+                self.snap_ellipse(elem, parent_transform)
+
+        if len(self.errors) == errors:                                  # Elements that couldn't be snapped are tried again next time
+            self.snapped(elem, context_transform, remember, key, before)
+
+    def snapped(self, elem, context_transform, remember, key=None, before=None):
+        """ Records that elem has been snapped: in the result cache (under
+            key, if there is one, with the attributes that differ from
+            before), and in its fingerprint if we're to remember it
+        """
+        if key:
+            self.cache.put(key, [(k, v) for k, v in elem.attrib.iteritems() if before.get(k) != v])
+        if remember:
+            self.set_attribute(elem, FingerprintAttr, self.fingerprint(elem, context_transform))
+
+    def snap_deferred(self):
+        """ Snaps the nodes of the paths that snap_object put off until
+            everything else had been snapped (with --time_budget), smallest
+            first, for as long as there's time
+        """
+        deferred, self.deferred = self.deferred, None
+        deferred.sort(key=lambda item: len(item[0].get('d') or item[0].get('points') or ''))
+        for i, (elem, parent_transform, context_transform, remember, key, before) in enumerate(deferred):
+            self.progress('Snapping path nodes', i, len(deferred))
+            if time.time() > self.deadline:
+                self.unshaped.extend(item[0] for item in deferred[i:])
+                return
+            try:
+                self.snap_path(elem, parent_transform)
+            except TransformError, e:
+                self.report_error(e)
+            else:
+                self.snapped(elem, context_transform, remember, key, before)
+
+    def progress(self, what, done, total):
+        """ Prints how far we've got to stderr, every --progress_interval seconds """
+        if self.progress_due is None or time.time() < self.progress_due: return
+        self.progress_due = time.time() + self.options.progress_interval
+        print >>sys.stderr, "%s: %d of %d done" % (what, done, total)
+
+    def affect(self, args=sys.argv[1:], output=True):
+        """ With --stream, the document is snapped as it's read (see
+            snap_stream), rather than parsed in full first
+        """
+        self.getoptions(args)
+        if not self.options.stream: return inkex.Effect.affect(self, args, output)
+        for name in StreamConflicts:
+            if getattr(self.options, name): self.OptionParser.error("--%s can't be used with --stream" % name)
+        source = self.args and open(self.args[-1], 'rb') or sys.stdin
+        try:
+            self.snap_stream(source, output and sys.stdout or open(os.devnull, 'wb'))
+        finally:
+            source.close()
+
+    def snap_stream(self, source, stream):
+        """ Snaps the document in source (a file) as it's read, writing it
+            to stream as it goes (see pixelsnap_stream)
+        """
+        pixelsnap_stream.snap_stream(self, source, stream)
+
+    def write_patched(self, stream):
+        """ Writes the input file to stream with only the attributes we've
+            changed patched in, returning False if it can't be written that
+            way (see pixelsnap_xml)
+        """
+        return pixelsnap_xml.write_patched(self, stream)
+
+    def output(self):
+        if self.options.audit: return                   # an audit leaves the document alone, so there's nothing to write
+        if not (self.options.patch_output and self.write_patched(sys.stdout)):
+            inkex.Effect.output(self)
+
+    def snap_elements(self, elems):
+        """ Snaps each of elems. With --time_budget, the nodes of paths are
+            snapped after everything else (see snap_deferred), since that
+            takes longest
+        """
+        elems = list(elems)
+        if self.deadline is not None: self.deferred = []
+        for i, elem in enumerate(elems):
+            self.progress('Snapping', i, len(elems))
+            try:
+                self.snap_object(elem)
+            except TransformError, e:
+                self.report_error(e)
+        if self.deferred is not None: self.snap_deferred()
+
+    def snap_selection(self):
+        # Snap the selection's shared ancestors once up-front, rather than once per selected element
+        with self.stats.phase('plan_ancestors'):
+            self.plan_ancestors([elem for elem in self.selected.itervalues() if elemtype(elem, Snappable)])
+
+        processes = self.options.layer_processes
+        if not processes:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+        partitions = processes > 1 and not self.options.snap_clones and pixelsnap_partition.partition_selection(self)   # clones' sources can be anywhere
+        if partitions and len(partitions) > 1:
+            with self.stats.phase('snap_partitions'):
+                pixelsnap_partition.snap_partitions(self, partitions, processes)
+        else:
+            self.snap_elements(self.selected.itervalues())
 
     def effect(self):
         svg = self.document.getroot()
+        if self.options.profile_report: self.stats = pixelsnap_profile.Instrumentation()
+        if self.options.patch_output: self.edits = {}
 
         # Note: when you change the document height, Inkscape adds a vertical translation
         # to each layer so that relative positions of the objects don't change. This
@@ -775,14 +1238,55 @@ class PixelSnapEffect(inkex.Effect):
             # although SVG units are absolute, the elements are positioned relative to the top of the page, rather than zero
             self.document_offset = unittouu(svg.attrib['height']) % 1
 
-        for id, elem in self.selected.iteritems():
-            try:
-                self.snap_object(elem)
-            except TransformError, e:
-                print >>sys.stderr, e
+        if self.options.remember_snaps and not self.options.audit: self.declare_namespace(svg)
+        if self.options.cache_file and not self.options.audit:
+            self.cache = pixelsnap_cache.ResultCache(self.options.cache_file, self.options.cache_size)
+        if self.options.time_budget: self.deadline = time.time() + self.options.time_budget
+        if self.options.progress_interval: self.progress_due = time.time() + self.options.progress_interval
+
+        densities = [float(d) for d in self.options.densities.split(',') if d.strip()]
+        if self.options.audit:
+            with self.stats.phase('plan_ancestors'):
+                self.plan_ancestors([elem for elem in self.selected.itervalues() if elemtype(elem, Snappable)])
+            pixelsnap_audit.audit(self)
+        elif densities:
+            pixelsnap_densities.snap_densities(self, densities)
+        else:
+            self.snap_selection()
+        self.finish()
+
+    def finish(self):
+        """ Reports what was left unsnapped for lack of time, closes the
+            result cache, reporting its hits & misses, and writes the profile
+            report
+        """
+        if self.unsnapped or self.unshaped:
+            print >>sys.stderr, "Ran out of time (--time_budget=%g):" % self.options.time_budget
+            name = lambda elem: elem.get('id') or elem.getroottree().getpath(elem)
+            listed = lambda elems: ', '.join(map(name, elems[:ListedUnfinished])) + \
+                                   (len(elems) > ListedUnfinished and ', ...' or '')
+            if self.unsnapped:
+                print >>sys.stderr, "  %d element%s left unsnapped: %s" % (
+                    len(self.unsnapped), len(self.unsnapped) != 1 and 's' or '', listed(self.unsnapped))
+            if self.unshaped:
+                print >>sys.stderr, "  %d path%s with only the transform & stroke width snapped, not the nodes: %s" % (
+                    len(self.unshaped), len(self.unshaped) != 1 and 's' or '', listed(self.unshaped))
+            if self.stats.enabled:
+                self.stats.unfinished = {'unsnapped': map(name, self.unsnapped), 'unshaped': map(name, self.unshaped)}
+        if self.cache is not None:
+            self.cache.close()
+            looked_up = self.cache.hits + self.cache.misses
+            print >>sys.stderr, "Result cache: %d hits, %d misses (%d%% hit rate)" % (
+                self.cache.hits, self.cache.misses, looked_up and 100 * self.cache.hits // looked_up)
+        if self.options.profile_report: self.stats.write(self.options.profile_report)
 
 
 if __name__ == '__main__':
     effect = PixelSnapEffect()
-    effect.affect()
+    try:
+        effect.affect()
+    except DocumentError, e:
+        print >>sys.stderr, e
+        sys.exit(1)
+    if effect.options.audit and effect.misaligned: sys.exit(1)
 
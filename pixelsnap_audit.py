@@ -0,0 +1,148 @@
+"""
+PixelSnap's --audit: checks that the selection is pixel-aligned -- that
+snapping it wouldn't move anything -- without changing the document.
+pixelsnap.py only imports this when auditing.
+"""
+
+import sys
+import numpy
+
+from pixelsnap import (AuditFailed, BoxElements, PathElements, Precision, Snappable, TransformError, elemtype,
+                       transform_dimensions, transform_point)
+from pixelsnap_path import round_half_away
+from pixelsnap_shape import straight_segments
+
+def misaligned_message(effect, elem, check, offset):
+    return "%s: %s is off by (%g, %g)px" % ((elem.get('id') or effect.document.getpath(elem), check) + offset)
+
+def report_misaligned(effect, elem, check, offset):
+    """ Records an element that fails one of audit_object's checks, by
+        how much (in px, as (dx, dy)) it's off the pixel grid
+    """
+    offset = tuple(round(o, Precision) + 0.0 for o in offset)
+    effect.misaligned.append((elem, check, offset))
+    print >>sys.stderr, misaligned_message(effect, elem, check, offset)
+    if effect.options.audit_fail_fast: raise AuditFailed(elem)
+
+def audit_check(effect, elem, check, offset):
+    if max(abs(o) for o in offset) > effect.options.audit_tolerance:
+        report_misaligned(effect, elem, check, offset)
+
+def audit_path(effect, elem, parent_transform=None):
+    """ The checks for a path depend on what snap_path would do to it:
+        'position' & 'size' of its bounding box with size_and_position,
+        and 'straight segments' (that every vertical/horizontal segment is
+        on a pixel boundary, as snap_path_intent would put it) with shape.
+    """
+    path = effect.path_geometry(elem)
+    if not len(path): return
+
+    if effect.options.modify_shapes == 'size_and_position':
+        min_xy, max_xy = effect.path_bounding_box(elem, parent_transform, path=path)
+        audit_check(effect, elem, 'position', (min_xy[0]-round(min_xy[0]),
+                                               min_xy[1]-round(min_xy[1]-effect.document_offset)-effect.document_offset))
+        width, height = max_xy[0] - min_xy[0], max_xy[1] - min_xy[1]
+        if width and height:
+            audit_check(effect, elem, 'size', (width-round(width), height-round(height)))
+
+    elif effect.options.modify_shapes == 'shape':
+        transform = effect.get_transform(elem, parent_transform)
+        if transform.skewed():
+            raise TransformError("Selection contains transformations with skew/rotation")
+        stroke_offset = effect.stroke_width_offset(elem, parent_transform)
+        transformed = transform.apply_array(path.points[path.ends])
+        next_node = path.next_nodes()
+        offset = [0, 0]
+        for axis, origin in ((0, stroke_offset), (1, stroke_offset + effect.document_offset)):
+            straight = straight_segments(effect, transformed, next_node, axis)
+            on_straight = numpy.empty_like(straight)
+            on_straight[next_node] = straight
+            pos = transformed[straight | on_straight, axis] - origin
+            if len(pos):
+                off = pos - round_half_away(pos)
+                offset[axis] = off[numpy.argmax(numpy.abs(off))]
+        audit_check(effect, elem, 'straight segments', offset)
+
+def audit_rect(effect, elem, parent_transform=None):
+    """ Checks a rect, image, circle or ellipse's 'position' & 'size' the
+        way snap_rect would snap them
+    """
+    transform = effect.get_transform(elem, parent_transform)
+    if transform.skewed():
+        raise TransformError("Selection contains transformations with skew/rotation")
+    offset = effect.stroke_width_offset(elem, parent_transform) % 1
+
+    x, y, width, height = effect.box(elem)
+    width, height = transform_dimensions(transform, width, height)
+    x, y = transform_point(transform, [x, y])
+    y -= effect.document_offset
+    audit_check(effect, elem, 'position', (x - (round(x - offset) + offset), y - (round(y - offset) + offset)))
+    audit_check(effect, elem, 'size', (width - round(width), height - round(height)))
+
+def audit_object(effect, elem, parent_transform=None):
+    """ Like snap_object, but only checks whether elem (or, for a group,
+        each element in it) is pixel-aligned: that snapping it wouldn't
+        move anything on screen. Nothing in the document is modified.
+        Each check that fails is passed to report_misaligned. An element
+        that's selected both itself and in a group is only checked once.
+    """
+    if not elemtype(elem, Snappable) or elem in effect.audited: return
+    effect.audited.add(elem)
+
+    if parent_transform is None:
+        parent = elem.getparent()
+        if parent is not None and parent not in effect.ancestor_transforms:
+            effect.plan_ancestors([elem])
+        ancestor_transform = effect.ancestor_transforms.get(parent)
+        if isinstance(ancestor_transform, TransformError): raise ancestor_transform
+        if effect.options.ancestor_offset:
+            parent_transform = ancestor_transform
+        else:
+            parent_transform = effect.density_transform
+
+    if elemtype(elem, 'g'):
+        group_transform = effect.get_transform(elem, parent_transform)
+        for e in elem:
+            try:
+                audit_object(effect, e, group_transform)
+            except TransformError, e:
+                effect.report_error(e)
+        return
+
+    try:
+        transform = effect.get_transform(elem, parent_transform)
+        stroke_width = effect.stroke_width(elem)
+        if stroke_width:
+            if abs(abs(transform.a) - abs(transform.d)) > (10**-Precision):
+                raise TransformError("Selection contains non-symetric scaling, can't snap stroke width")
+            stroke_width = transform_dimensions(transform, width=stroke_width)
+            audit_check(effect, elem, 'stroke width', (stroke_width - round(stroke_width), 0))
+    except TransformError, e:
+        effect.report_error(e)
+
+    if elemtype(elem, 'use'):                                       # A clone's translation is all that snapping moves
+        transform = effect.get_transform(elem)
+        audit_check(effect, elem, 'translation', (transform.e - round(transform.e), transform.f - round(transform.f)))
+    elif elemtype(elem, PathElements):
+        audit_path(effect, elem, parent_transform)
+    elif elemtype(elem, BoxElements):
+        audit_rect(effect, elem, parent_transform)
+
+def audit(effect):
+    """ effect() for --audit: checks each selected element, and prints a summary """
+    try:
+        for id, elem in effect.selected.iteritems():
+            try:
+                audit_object(effect, elem)
+            except TransformError, e:
+                effect.report_error(e)
+    except AuditFailed:
+        pass
+
+    print >>sys.stderr, audit_summary(effect)
+
+def audit_summary(effect):
+    if effect.misaligned:
+        return "%d check%s failed: the selection isn't pixel-aligned" % (
+            len(effect.misaligned), len(effect.misaligned) != 1 and 's' or '')
+    return "The selection is pixel-aligned"
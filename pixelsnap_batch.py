@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Runs PixelSnap over many SVG files at once, outside of Inkscape, spreading the
+files over a pool of worker processes (one per core by default).
+
+Usage:
+    python pixelsnap_batch.py --output_dir=DIR [pixelsnap options] FILE_OR_DIR...
+
+Directories are searched (recursively) for *.svg files, and the snapped files
+are written to the same relative location under --output_dir. Since there's no
+Inkscape selection, say what to snap with any of:
+    --select_all=true       every snappable element in every layer
+    --select_xpath=EXPR     elements matching an XPath expression (svg:, inkscape:
+                            etc. prefixes are available)
+    --select_region=R       elements intersecting x,y,width,height, or the
+                            artboard (inkscape:page or element) with id/label R
+    --id=ID                 as Inkscape passes it, may be repeated
+
+Any other PixelSnap option (--modify_shapes, --max_gradient etc.) applies to
+every file. When all files are done, a summary of each file's outcome and of
+the TransformErrors encountered is printed to stderr. The exit status is 1 if
+any file couldn't be processed at all.
+
+With --audit=true nothing is written (and --output_dir isn't needed): each
+file is only checked, and counts as failed if anything in it isn't
+pixel-aligned, so the exit status can gate a CI build.
+
+With --densities (e.g. --densities=1,2,3), each file is snapped once per
+density instead, and written as NAME@<density>x.svg under --output_dir.
+
+With --stream=true, each file is snapped as it's read, for files too big to
+hold in memory (see pixelsnap.py's help).
+"""
+
+from __future__ import division
+
+import sys, os, time, copy
+import multiprocessing
+from lxml import etree
+
+from pixelsnap import PixelSnapEffect, StreamConflicts
+
+def find_svgs(paths):
+    """ Yields (input file, path relative to the output directory) """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith('.svg'):
+                        infile = os.path.join(dirpath, name)
+                        yield infile, os.path.relpath(infile, path)
+        else:
+            yield path, os.path.basename(path)
+
+def make_dirs(outdir):
+    if outdir and not os.path.isdir(outdir):
+        try:
+            os.makedirs(outdir)
+        except OSError:
+            if not os.path.isdir(outdir): raise             # another worker may have just created it
+
+def snap_file(job):
+    """ Snaps a single file, returning (input file, error or None, TransformError messages, seconds) """
+    infile, outfile, options = job
+    start = time.time()
+    effect = PixelSnapEffect()
+    if options.densities:                                   # snap_densities writes one file per density, next to outfile
+        options = copy.copy(options)
+        options.density_dir = os.path.dirname(outfile)
+    try:
+        effect.options, effect.args = options, [infile]
+        effect.svg_file = infile
+        if options.stream:                                  # snap_stream reads & writes the file a piece at a time
+            make_dirs(os.path.dirname(outfile))
+            with open(infile, 'rb') as source:
+                with open(outfile, 'wb') as stream:
+                    effect.snap_stream(source, stream)
+            return infile, None, [str(err) for err in effect.errors], time.time() - start
+
+        effect.document = etree.parse(infile)              # not effect.parse(), which falls back to reading stdin
+        effect.getselected()
+
+        if not options.audit: make_dirs(os.path.dirname(outfile))
+        effect.effect()
+        if options.audit:
+            misaligned = effect.misaligned and "%d misaligned" % len(effect.misaligned) or None
+            return infile, misaligned, [str(err) for err in effect.errors], time.time() - start
+        if not options.densities:
+            with open(outfile, 'wb') as stream:
+                if not (options.patch_output and effect.write_patched(stream)):
+                    effect.document.write(stream)
+    except Exception, e:
+        return infile, '%s: %s' % (e.__class__.__name__, e), [str(err) for err in effect.errors], time.time() - start
+    return infile, None, [str(err) for err in effect.errors], time.time() - start
+
+def main(args=sys.argv[1:]):
+    effect = PixelSnapEffect()
+    parser = effect.OptionParser
+    parser.set_usage("usage: %prog --output_dir=DIR [options] FILE_OR_DIR...")
+    parser.add_option('--output_dir', action="store", type="string", dest="output_dir", default=None,
+                      help="Directory to write the snapped files to")
+    parser.add_option('--jobs', action="store", type="int", dest="jobs", default=0,
+                      help="Number of worker processes (default: one per core)")
+    options, paths = parser.parse_args(args)
+    if not (options.output_dir or options.audit): parser.error("--output_dir is required")
+    if not paths: parser.error("no input files or directories given")
+    for name in StreamConflicts:
+        if options.stream and getattr(options, name): parser.error("--%s can't be used with --stream" % name)
+    if not (options.ids or options.select_all or options.select_xpath or options.select_region):
+        print >>sys.stderr, "Nothing is selected: use --select_all, --select_xpath, --select_region or --id"
+
+    jobs = [(infile, os.path.join(options.output_dir or '', relpath), options) for infile, relpath in find_svgs(paths)]
+    processes = options.jobs or multiprocessing.cpu_count()
+
+    start = time.time()
+    if processes == 1:
+        results = map(snap_file, jobs)
+    else:
+        pool = multiprocessing.Pool(min(processes, len(jobs)) or 1)
+        results = pool.map(snap_file, jobs, chunksize=max(1, len(jobs) // (processes * 4)))
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    failed = 0
+    error_counts = {}
+    for infile, failure, errors, seconds in results:
+        if failure:
+            failed += 1
+            outcome = 'FAILED (%s)' % failure
+        elif errors:
+            outcome = '%s, %d TransformError%s' % (options.audit and 'aligned' or 'snapped', len(errors), len(errors) != 1 and 's' or '')
+        else:
+            outcome = options.audit and 'aligned' or 'snapped'
+        print >>sys.stderr, "%s: %s [%.2fs]" % (infile, outcome, seconds)
+        for e in errors:
+            error_counts[e] = error_counts.get(e, 0) + 1
+
+    print >>sys.stderr, "\n%d files in %.1fs with %d processes: %d %s, %d failed" % (
+        len(results), elapsed, processes, len(results) - failed, options.audit and 'aligned' or 'snapped', failed)
+    if error_counts:
+        print >>sys.stderr, "TransformErrors:"
+        for e, count in sorted(error_counts.items(), key=lambda item: -item[1]):
+            print >>sys.stderr, "  %6d  %s" % (count, e)
+
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
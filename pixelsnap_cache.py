@@ -0,0 +1,51 @@
+"""
+The --cache_file of PixelSnap's results, shared between runs. pixelsnap.py
+only imports this (and sqlite3) when a cache file is given.
+"""
+
+import time, json, sqlite3
+
+class ResultCache(object):
+    """ An SQLite database of key -> the attributes that snapping an element
+        wrote (see PixelSnapEffect.result_key), shared between runs & files.
+        Results are looked up as they're needed, but the new ones (and which
+        old ones were used) are only written by close(), in one transaction,
+        when the least recently used are also dropped to keep at most
+        max_results.
+    """
+    def __init__(self, filename, max_results):
+        self.db = sqlite3.connect(filename, timeout=60)         # other processes may be writing theirs
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, attributes TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.db.commit()
+        self.max_results = max_results
+        self.added = {}                 # key -> attributes (as JSON) of results new this run
+        self.used = set()               # keys of the stored results used this run
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """ Returns the [(name, value)] stored for key, or None """
+        attributes = self.added.get(key)
+        if attributes is None:
+            row = self.db.execute('SELECT attributes FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            attributes = row[0]
+            self.used.add(key)
+        self.hits += 1
+        return json.loads(attributes)
+
+    def put(self, key, attributes):
+        self.added[key] = json.dumps(attributes)
+
+    def close(self):
+        now = time.time()
+        with self.db:
+            self.db.executemany('UPDATE results SET used = ? WHERE key = ?', [(now, key) for key in self.used])
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                [(key, attributes, now) for key, attributes in self.added.iteritems()])
+            excess = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_results
+            if excess > 0:
+                self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+        self.db.close()
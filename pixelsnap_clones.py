@@ -0,0 +1,92 @@
+"""
+PixelSnap's --snap_clones: snaps the elements that clones (<use> elements)
+refer to, as each clone draws them. pixelsnap.py only imports this when
+--snap_clones is on.
+"""
+
+import copy
+import inkex
+
+from pixelsnap import Affine, Precision, Snappable, TransformError, elemtype, unittouu
+
+def clone_class(effect, transform):
+    """ Clones whose transforms differ only by a whole-pixel translation
+        snap their source the same way, so they share a clone_class
+    """
+    return tuple(round(v, Precision) for v in (transform.a, transform.b, transform.c, transform.d)) + \
+           (round(transform.e, Precision) % 1, round(transform.f, Precision) % 1)
+
+def renders_itself(effect, elem):
+    """ False for elements that are only drawn by reference, in <defs> or a <symbol> """
+    return not any(elemtype(e, ('defs', 'symbol')) for e in elem.iterancestors()) and not elemtype(elem, 'symbol')
+
+def copy_clone_source(effect, source):
+    """ Makes a copy of source, with new ids, for clones that need it
+        snapped differently. It goes in the same <defs>/<symbol> as the
+        source, or in the document's <defs> if the source is drawn itself.
+    """
+    clone = copy.deepcopy(effect.clone_originals.get(source, source))
+    for e in clone.iter():
+        if e.get('id'):
+            n = 1
+            while effect.element_by_id('%s-%d' % (e.get('id'), n)) is not None: n += 1
+            e.set('id', '%s-%d' % (e.get('id'), n))
+            effect.id_map[e.get('id')] = e
+
+    if renders_itself(effect, source):
+        svg = effect.document.getroot()
+        defs = svg.find(inkex.addNS('defs', 'svg'))
+        if defs is None:
+            defs = inkex.etree.Element(inkex.addNS('defs', 'svg'))
+            svg.insert(0, defs)
+        defs.append(clone)
+    else:
+        source.addnext(clone)
+    effect.clone_copies.append(clone)
+    return clone
+
+def snap_clone(effect, elem, parent_transform=None):
+    """ Snaps the element that a clone refers to, as it's drawn by the
+        clone. Each source is snapped once for each clone_class it's
+        cloned with (see clone_cache): the first class snaps the source
+        itself, unless the source is drawn in its own right with a
+        different transform, and each other class gets its own copy of
+        the source that its clones are pointed at instead. Clones stay
+        clones.
+    """
+    href_attr = inkex.addNS('href', 'xlink')
+    href = elem.get(href_attr, '')
+    if not href.startswith('#'): return
+    source = effect.element_by_id(href[1:])
+    if source is None or not elemtype(source, Snappable + ('symbol',)): return
+    if elemtype(source, 'symbol') and source.get('viewBox'):
+        raise TransformError("Can't snap clones of symbols with a viewBox")
+
+    transform = effect.get_transform(elem, parent_transform).compose(
+        Affine(e=unittouu(elem.get('x', '0')), f=unittouu(elem.get('y', '0'))))
+    key = href, clone_class(effect, transform)
+    if key in effect.clone_cache:
+        effect.stats.count('clones sharing a snapped source')
+        effect.set_attribute(elem, href_attr, '#' + effect.clone_cache[key])
+        return
+
+    if source in effect.clone_sources:
+        target = copy_clone_source(effect, source)
+    elif renders_itself(effect, source):
+        own_transform = Affine()
+        if effect.options.ancestor_offset:
+            effect.plan_ancestors([source])
+            own_transform = effect.ancestor_transforms.get(source.getparent())
+            if isinstance(own_transform, TransformError): raise own_transform
+        if clone_class(effect, own_transform) == key[1]: target = source
+        else: target = copy_clone_source(effect, source)
+    else:
+        target = source
+    if target is source: effect.clone_originals[source] = copy.deepcopy(source)
+    effect.clone_sources[target] = key[1]
+    effect.clone_cache[key] = target.get('id')
+    effect.set_attribute(elem, href_attr, '#' + target.get('id'))
+
+    effect.stats.count('clone sources snapped')
+    if elemtype(target, 'symbol'): effect.snap_group(target, transform)
+    else: effect.snap_object(target, transform)
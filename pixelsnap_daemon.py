@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+Keeps PixelSnap (and numpy, inkex etc.) loaded in a long-running process, so
+that snapping a small file doesn't pay for starting Python & importing them
+every time.
+
+Start the server with either of:
+    python pixelsnap_daemon.py --serve [--socket=PATH]
+        listens on a local Unix socket (default: $PIXELSNAP_SOCKET, or
+        pixelsnap.sock in $XDG_RUNTIME_DIR, or else in pixelsnap-<uid> in
+        the temp directory, which the server makes owner-only)
+    python pixelsnap_daemon.py --serve --stdio
+        reads jobs from stdin & writes results to stdout, one per line
+
+Then use the client in place of pixelsnap.py -- it takes the same arguments,
+and writes the snapped SVG to stdout just as pixelsnap.py does:
+    python pixelsnap_daemon.py [pixelsnap options] FILE
+If no server is listening, the client snaps the file itself -- as it does if
+the socket belongs to another user, who could be listening in the server's place.
+
+Protocol: each job and each result is a single line of JSON,
+    job:    {"args": [pixelsnap options, including --id=...], "svg": base64 SVG}
+    result: {"svg": base64 SVG, "errors": [TransformError messages]}
+            or, with --audit=true, {"audit": [report lines], "misaligned":
+            number of failed checks, "errors": [TransformError messages]}
+            or {"error": message} if the job failed outright
+Every job gets its own PixelSnapEffect, so options don't carry over between jobs.
+--densities, --patch_output and --stream don't fit a single SVG in & out, so
+jobs using them fail with an error (the client, snapping a file itself when no
+server is listening, still handles them as pixelsnap.py does).
+
+The client deliberately imports nothing heavier than json & socket.
+"""
+
+import sys, os, json, socket, base64, tempfile
+
+# Options that write files of their own, or read the input file as it is on
+# disk, rather than give back one snapped SVG
+FileOptions = ('densities', 'patch_output', 'stream')
+
+def default_socket():
+    if os.environ.get('PIXELSNAP_SOCKET'): return os.environ['PIXELSNAP_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'): return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'pixelsnap.sock')
+    uid = hasattr(os, 'getuid') and os.getuid() or 0
+    return os.path.join(tempfile.gettempdir(), 'pixelsnap-%d' % uid, 'pixelsnap.sock')
+
+def owned(path):
+    """ Whether path belongs to us, rather than to someone else who could be
+        listening on it (raises OSError if there's nothing there)
+    """
+    return not hasattr(os, 'getuid') or os.stat(path).st_uid == os.getuid()
+
+# ------------------------------------------------------------------ server
+
+def run_job(job):
+    """ Snaps one job's SVG, returning the result message """
+    from StringIO import StringIO
+    from lxml import etree
+    from pixelsnap import PixelSnapEffect
+
+    effect = PixelSnapEffect()
+    try:
+        effect.getoptions([str(arg) for arg in job.get('args', [])])
+        for name in FileOptions:
+            if getattr(effect.options, name): return {'error': "--%s can't be used through the server" % name}
+        effect.document = etree.parse(StringIO(base64.b64decode(job['svg'])))
+        effect.getposinlayer()
+        effect.getselected()
+        effect.getdocids()
+        effect.effect()
+        if effect.options.audit:                                # nothing to write, just the report
+            import pixelsnap_audit
+            report = [pixelsnap_audit.misaligned_message(effect, *failure) for failure in effect.misaligned]
+            return {'audit': report + [pixelsnap_audit.audit_summary(effect)], 'misaligned': len(effect.misaligned),
+                    'errors': [str(e) for e in effect.errors]}
+
+        output = StringIO()
+        effect.document.write(output)
+        return {'svg': base64.b64encode(output.getvalue()), 'errors': [str(e) for e in effect.errors]}
+    except SystemExit:                                          # optparse exits on bad options
+        return {'error': "Invalid options: %s" % ' '.join(job.get('args', []))}
+    except Exception, e:
+        return {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+def serve_lines(infile, outfile):
+    """ Handles JSON-lines jobs until infile is exhausted """
+    for line in iter(infile.readline, ''):
+        if not line.strip(): continue
+        try:
+            result = run_job(json.loads(line))
+        except ValueError, e:
+            result = {'error': 'Invalid job: %s' % e}
+        outfile.write(json.dumps(result) + '\n')
+        outfile.flush()
+
+def serve(path):
+    import SocketServer, signal
+    import pixelsnap                                            # import everything now, not on the first job
+
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            serve_lines(self.rfile, self.wfile)
+
+    class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory): os.makedirs(directory, 0700)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)                                     # left over from a server that didn't shut down cleanly
+        else:
+            print >>sys.stderr, "A PixelSnap server is already listening on %s" % path
+            return 1
+        finally:
+            probe.close()
+    umask = os.umask(077)                                       # the socket is created owner-only, rather than chmod-ed after it's listening
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))   # so the socket gets cleaned up below
+    print >>sys.stderr, "PixelSnap server listening on %s" % path
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+    return 0
+
+# ------------------------------------------------------------------ client
+
+def request(path, job):
+    """ Sends a job to the server at path, returning the result, or None if
+        there's no server listening (or none of ours)
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if not owned(path):
+            print >>sys.stderr, "Not using %s, which belongs to another user" % path
+            sock.close()
+            return None
+        sock.connect(path)
+    except (OSError, socket.error):
+        sock.close()
+        return None
+    try:
+        sock.sendall(json.dumps(job) + '\n')
+        stream = sock.makefile('rb')
+        return json.loads(stream.readline())
+    finally:
+        sock.close()
+
+def client(args):
+    """ Behaves like pixelsnap.py itself: snaps the SVG file given as the last
+        argument (or stdin) and writes it to stdout, or with --audit=true
+        only reports, returning 1 if the audit failed
+    """
+    path = default_socket()
+    options = [a for a in args if a.startswith('--socket=')]
+    if options:
+        path = options[-1].split('=', 1)[1]
+        args = [a for a in args if not a.startswith('--socket=')]
+
+    filename = None
+    if args and not args[-1].startswith('-'):
+        filename = args.pop()
+        svg = open(filename, 'rb').read()
+    else:
+        svg = sys.stdin.read()
+
+    result = None
+    if hasattr(socket, 'AF_UNIX'):
+        result = request(path, {'args': args, 'svg': base64.b64encode(svg)})
+    if result is None:                                          # no server, so do it ourselves
+        import pixelsnap
+        if filename is None:
+            tmp = tempfile.NamedTemporaryFile(suffix='.svg', delete=False)
+            tmp.write(svg)
+            tmp.close()
+        effect = pixelsnap.PixelSnapEffect()
+        try:
+            effect.affect(args + [filename or tmp.name])
+        except pixelsnap.DocumentError, e:
+            print >>sys.stderr, e
+            return 1
+        finally:
+            if filename is None: os.unlink(tmp.name)
+        return effect.options.audit and effect.misaligned and 1 or 0
+
+    if 'error' in result:
+        print >>sys.stderr, result['error']
+        return 1
+    for e in result['errors']:
+        print >>sys.stderr, e
+    if 'audit' in result:                                       # as pixelsnap.py does, the exit status says if it failed
+        for line in result['audit']:
+            print >>sys.stderr, line
+        return result['misaligned'] and 1 or 0
+    sys.stdout.write(base64.b64decode(result['svg']))
+    return 0
+
+def main(args=sys.argv[1:]):
+    if '--serve' not in args:
+        return client(args)
+    if '--stdio' in args:
+        import pixelsnap
+        serve_lines(sys.stdin, sys.stdout)
+    else:
+        path = default_socket()
+        for a in args:
+            if a.startswith('--socket='): path = a.split('=', 1)[1]
+        return serve(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+PixelSnap's --densities: snaps the selection once for each pixel density, and
+writes each result to its own file. pixelsnap.py only imports this when
+--densities is given.
+"""
+
+import os, re
+
+from pixelsnap import Affine, DocumentError, format_number, unittouu
+
+def density_filename(effect, density):
+    """ Where snap_densities writes the document for the given density """
+    name = os.path.splitext(os.path.basename(getattr(effect, 'svg_file', None) or 'drawing.svg'))[0]
+    directory = effect.options.density_dir or os.path.dirname(getattr(effect, 'svg_file', None) or '')
+    return os.path.join(directory, '%s@%gx.svg' % (name, density))
+
+def canvas_size(effect):
+    """ The document's width & height, in user units. They have to be
+        lengths: a percentage (or leaving them out, which is 100%) sizes
+        the document by whatever it's shown in, so there's no telling
+        what a pixel is, or what scaling it for a density would mean.
+    """
+    svg = effect.document.getroot()
+    sizes = [svg.get(attr, '100%') for attr in ('width', 'height')]
+    for attr, size in zip(('width', 'height'), sizes):
+        if size.strip().endswith('%'):
+            raise DocumentError("--densities needs the document's %s to be a length, not %s" % (attr, size.strip()))
+    return [unittouu(size) for size in sizes]
+
+def scale_canvas(effect, density):
+    """ Scales the document's width & height (keeping their units) by
+        density, adding a viewBox if there isn't one, so that it renders
+        at that density without changing the drawing's user units.
+    """
+    svg = effect.document.getroot()
+    if 'viewBox' not in svg.attrib:
+        effect.set_attribute(svg, 'viewBox', '0 0 %s %s' % tuple(map(format_number, canvas_size(effect))))
+    for attr in ('width', 'height'):
+        number, unit = re.match(r'\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)(.*)', svg.attrib[attr]).groups()
+        effect.set_attribute(svg, attr, format_number(float(number) * density) + unit.strip())
+
+def snap_densities(effect, densities):
+    """ Snaps the selection once for each pixel density (scale factor),
+        as if the document were drawn that many times bigger, and writes
+        each result to its own file (see density_filename). Each pass
+        starts from the document as it was given; paths are only parsed
+        once (see path_geometry), and styles & transforms are only
+        resolved again where a previous pass changed them.
+
+        The first density is done last, so that's the document that's
+        left for output(). Raises DocumentError, before snapping anything, if
+        the document's size is a percentage (see canvas_size).
+    """
+    svg = effect.document.getroot()
+    height = canvas_size(effect)[1]
+    originals = [(e, e.attrib.items()) for e in svg.iter() if isinstance(e.tag, basestring)]
+    effect.path_cache = {}
+
+    for density in reversed(densities):
+        for clone in effect.clone_copies: clone.getparent().remove(clone)
+        effect.clone_copies, effect.clone_cache, effect.clone_sources, effect.clone_originals, effect.id_map = [], {}, {}, {}, None
+        for elem, attrib in originals:                              # undo the previous pass
+            if elem.attrib.items() != attrib:
+                effect.replace_attributes(elem, attrib)
+                for e in elem.iter(): effect.style_cache.pop(e, None)
+        effect.ancestor_transforms.clear()
+
+        effect.density_transform = density != 1 and Affine(density, 0, 0, density, 0, 0) or None
+        effect.document_offset = effect.options.ancestor_offset and (height * density) % 1 or 0
+        effect.snap_selection()
+
+        if density != 1: scale_canvas(effect, density)
+        effect.document.write(density_filename(effect, density))
@@ -0,0 +1,173 @@
+"""
+PixelSnap's --select_region: finds the elements in a region of the document
+with a spatial index, a uniform grid over the bounding boxes of its elements.
+pixelsnap.py only imports this when a region is selected.
+"""
+
+from __future__ import division
+
+import sys, os, json
+import inkex
+
+from pixelsnap import Affine, BoxElements, PathElements, Snappable, elemtype, unittouu
+
+MinCellSize = 10**-5            # as small a distance as pixelsnap tells apart (its Precision)
+
+def boxes_intersect(a, b):
+    """ Whether boxes a & b (min_x, min_y, max_x, max_y) overlap or touch """
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+class GridIndex(object):
+    """ A grid of square cells laid over the bounding boxes of a set of
+        items, each cell listing the items whose boxes overlap it, for
+        finding the items that intersect a rectangle without testing every
+        one. It's built in one go, with about as many cells as items.
+    """
+    def __init__(self, boxes):
+        self.boxes = boxes              # item -> (min_x, min_y, max_x, max_y)
+        self.cells = {}                 # (column, row) -> [items]
+        self.columns = self.rows = 0
+        if not boxes: return
+
+        self.min_x = min(box[0] for box in boxes.itervalues())
+        self.min_y = min(box[1] for box in boxes.itervalues())
+        width = max(box[2] for box in boxes.itervalues()) - self.min_x
+        height = max(box[3] for box in boxes.itervalues()) - self.min_y
+        self.size = max(width, height, MinCellSize) / int(len(boxes) ** 0.5 + 1)
+        self.columns, self.rows = int(width / self.size) + 1, int(height / self.size) + 1
+        for item, box in boxes.iteritems():
+            for cell in self.cells_over(box):
+                self.cells.setdefault(cell, []).append(item)
+
+    def cells_over(self, box):
+        """ The (column, row) of each cell that box overlaps """
+        columns = range(max(0, int((box[0] - self.min_x) // self.size)), min(self.columns, int((box[2] - self.min_x) // self.size) + 1))
+        rows = range(max(0, int((box[1] - self.min_y) // self.size)), min(self.rows, int((box[3] - self.min_y) // self.size) + 1))
+        return [(column, row) for column in columns for row in rows]
+
+    def query(self, box):
+        """ Returns the set of items whose boxes intersect box (min_x, min_y, max_x, max_y) """
+        found = set()
+        if not self.boxes: return found
+        for cell in self.cells_over(box):
+            for item in self.cells.get(cell, ()):
+                if boxes_intersect(self.boxes[item], box): found.add(item)
+        return found
+
+def extent(effect, elem, transform, exact=False, depth=0):
+    """ Returns (min_x, min_y, max_x, max_y) of elem with transform (its
+        own transform & its ancestors', composed as
+        get_ancestor_transform does), or None if it has no size or isn't
+        something we snap. The stroke isn't included. Unless exact,
+        curves are boxed by their handles (see PathGeometry.control_box),
+        so the box may be a little too big, but never too small.
+    """
+    if elemtype(elem, PathElements):
+        path = effect.path_geometry(elem)
+        bbox = exact and path.bounding_box(transform) or path.control_box(transform)
+        return bbox and tuple(bbox[0] + bbox[1])
+    if elemtype(elem, BoxElements):
+        try:
+            x, y, width, height = effect.box(elem)
+        except KeyError:
+            return None
+        corners = [transform.apply(px, py) for px in (x, x + width) for py in (y, y + height)]
+        return (min(c[0] for c in corners), min(c[1] for c in corners),
+                max(c[0] for c in corners), max(c[1] for c in corners))
+
+    if elemtype(elem, 'use'):                                       # a clone is as big as its source, where the clone draws it
+        href = elem.get(inkex.addNS('href', 'xlink'), '')
+        source = effect.element_by_id(href[1:]) if href.startswith('#') and depth < 32 else None
+        if source is None: return None
+        elems, transform = [source], transform.compose(Affine(e=unittouu(elem.get('x', '0')), f=unittouu(elem.get('y', '0'))))
+    elif elemtype(elem, ('g', 'a', 'switch', 'symbol')):
+        elems = elem
+    else:
+        return None
+    boxes = [extent(effect, e, effect.get_transform(e, transform), exact, depth + 1) for e in elems if isinstance(e.tag, basestring)]
+    boxes = [box for box in boxes if box]
+    return boxes and (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                      max(b[2] for b in boxes), max(b[3] for b in boxes)) or None
+
+def element_boxes(effect, elem, transform, boxes):
+    """ Adds the extent of each snappable element that's drawn below elem
+        (other than groups, which are descended into) to boxes, in one
+        pass from the top down
+    """
+    for child in elem:
+        if not isinstance(child.tag, basestring): continue
+        child_transform = effect.get_transform(child, transform)
+        if elemtype(child, ('g', 'a', 'switch')):
+            element_boxes(effect, child, child_transform, boxes)
+        elif elemtype(child, Snappable):
+            box = extent(effect, child, child_transform)
+            if box: boxes[child] = box
+
+def region_index(effect):
+    """ Returns (the document's elements, a GridIndex of the extent of
+        each snappable one by its position in that list). With
+        --index_cache, the extents are kept next to the input file, and
+        only worked out again when the file has changed.
+    """
+    root = effect.document.getroot()
+    elements = [e for e in root.iter() if isinstance(e.tag, basestring)]
+    svg_file = getattr(effect, 'svg_file', None)
+    filename = effect.options.index_cache and svg_file and os.path.isfile(svg_file) and svg_file + '.pixelsnap-index'
+    if filename:
+        stat = os.stat(svg_file)
+        signature = [stat.st_size, stat.st_mtime, len(elements)]
+        try:
+            cached = json.load(open(filename))
+            if cached['signature'] == signature:
+                return elements, GridIndex(dict((i, tuple(box)) for i, box in cached['boxes']))
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+    with effect.stats.phase('index'):
+        boxes = {}
+        element_boxes(effect, root, effect.get_transform(root), boxes)
+        number = dict((e, i) for i, e in enumerate(elements))
+        boxes = dict((number[e], box) for e, box in boxes.iteritems())
+    if filename:
+        try:
+            json.dump({'signature': signature, 'boxes': sorted(boxes.items())}, open(filename, 'w'))
+        except IOError, e:
+            print >>sys.stderr, "Couldn't write %s: %s" % (filename, e)
+    return elements, GridIndex(boxes)
+
+def region_elements(effect, region):
+    """ Returns the snappable elements (other than groups) that
+        intersect region: 'x,y,width,height' in user units, or the id or
+        label of an artboard -- an inkscape:page, or any other element,
+        which isn't itself returned
+    """
+    elements, index = region_index(effect)
+    artboard = None
+    try:
+        x, y, width, height = [float(v) for v in region.split(',')]
+    except ValueError:
+        label, page = inkex.addNS('label', 'inkscape'), inkex.addNS('page', 'inkscape')
+        matches = [e for e in elements if region in (e.get('id'), e.get(label))]
+        if not matches:
+            print >>sys.stderr, "There's no artboard or element called %r, so nothing is selected" % region
+            return []
+        artboard = sorted(matches, key=lambda e: e.tag != page)[0]
+        if artboard.tag == page:
+            x, y, width, height = [unittouu(artboard.get(a, '0')) for a in ('x', 'y', 'width', 'height')]
+        else:
+            box = extent(effect, artboard, effect.get_transform(artboard, effect.get_ancestor_transform(artboard)), exact=True)
+            if box is None: return []
+            x, y, width, height = box[0], box[1], box[2] - box[0], box[3] - box[1]
+
+    region = x, y, x + width, y + height
+    selected = []
+    for i in sorted(index.query(region)):
+        elem, box = elements[i], index.boxes[i]
+        if elem is artboard: continue
+        if not (box[0] >= region[0] and box[1] >= region[1] and box[2] <= region[2] and box[3] <= region[3]):
+            # Straddling the edge of the region, where a curve's handles
+            # may reach in when the curve itself doesn't
+            box = extent(effect, elem, effect.get_transform(elem, effect.get_ancestor_transform(elem)), exact=True)
+            if not (box and boxes_intersect(box, region)): continue
+        selected.append(elem)
+    return selected
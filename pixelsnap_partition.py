@@ -0,0 +1,114 @@
+"""
+PixelSnap's --layer_processes: snaps each top-level layer (or other element)
+holding part of the selection in its own worker process. pixelsnap.py only
+imports this when there's more than one process to use.
+"""
+
+import time, copy
+import inkex
+
+from pixelsnap import PixelSnapEffect, TransformError
+
+def partition_selection(effect):
+    """ Returns [(top-level element, [selected elements inside it])], in
+        document order. Once their ancestors have been snapped, the
+        elements in each partition can be snapped independently of the
+        others.
+    """
+    root = effect.document.getroot()
+    partitions = {}
+    for elem in effect.selected.itervalues():
+        top = elem
+        while top.getparent() is not None and top.getparent() is not root: top = top.getparent()
+        if top is root: continue
+        partitions.setdefault(top, []).append(elem)
+    return [(top, partitions[top]) for top in root if top in partitions]
+
+def snap_partitions(effect, partitions, processes):
+    """ Snaps each partition (see partition_selection) in a pool of
+        worker processes. Each worker is sent its partition as a
+        standalone document (see partition_job), and sends back the
+        attributes of each element that it changed, which are merged
+        back into the document here: the result is the same as snapping
+        the selection in this process.
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(min(processes, len(partitions)))
+    try:
+        results = pool.map(snap_partition, [partition_job(effect, top, elems) for top, elems in partitions], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    for (top, elems), (changes, errors, report, cached, late) in zip(partitions, results):
+        nodes = list(top.iter())
+        for i, attrib in changes:
+            elem = nodes[i]
+            effect.replace_attributes(elem, attrib)
+            for e in elem.iter(): effect.style_cache.pop(e, None)
+            if elem in effect.ancestor_transforms: effect.ancestor_transforms.clear()
+        for e in errors:                                            # the worker has already printed them
+            effect.errors.append(TransformError(e))
+            effect.stats.error(e)
+        if report: effect.stats.merge(report)
+        if effect.cache is not None:
+            effect.cache.hits += cached[0]
+            effect.cache.misses += cached[1]
+        effect.unsnapped.extend(nodes[i] for i in late[0])
+        effect.unshaped.extend(nodes[i] for i in late[1])
+
+def partition_job(effect, top, elems):
+    """ What snap_partition needs to snap one partition: the partition
+        in a copy of the root element (with the document's <style>
+        elements, for computed_style), the selected elements & planned
+        ancestor transforms (both by their index in top.iter()), and the
+        settings that effect() worked out.
+    """
+    root = effect.document.getroot()
+    skeleton = inkex.etree.Element(root.tag, dict(root.attrib), nsmap=root.nsmap)
+    for style in root.iter(inkex.addNS('style', 'svg')):
+        if top not in style.iterancestors(): skeleton.append(copy.deepcopy(style))
+    skeleton.append(copy.deepcopy(top))
+
+    index = dict((e, i) for i, e in enumerate(top.iter()))
+    ancestor_transforms = [(index.get(a), transform) for a, transform in effect.ancestor_transforms.iteritems()
+                           if a is root or a in index]
+    return (effect.options, inkex.etree.tostring(skeleton), [index[e] for e in elems], ancestor_transforms,
+            effect.document_offset, effect.density_transform, effect.deadline)
+
+def snap_partition(job):
+    """ Snaps one partition in a worker process (see snap_partitions),
+        returning ([(index, attributes)] for each element whose attributes
+        changed, [TransformError messages], its profile report or None,
+        (cache hits, cache misses), and the indexes of the elements left
+        unsnapped & unshaped for lack of time)
+    """
+    options, svg, selected, ancestor_transforms, document_offset, density_transform, deadline = job
+    effect = PixelSnapEffect()
+    effect.options = options
+    effect.document = inkex.etree.ElementTree(inkex.etree.fromstring(svg))
+    effect.document_offset, effect.density_transform, effect.deadline = document_offset, density_transform, deadline
+    if options.profile_report:
+        import pixelsnap_profile
+        effect.stats = pixelsnap_profile.Instrumentation()
+    if options.progress_interval: effect.progress_due = time.time() + options.progress_interval
+    if options.cache_file:
+        import pixelsnap_cache
+        effect.cache = pixelsnap_cache.ResultCache(options.cache_file, options.cache_size)
+
+    top = effect.document.getroot()[-1]
+    nodes = list(top.iter())
+    for i, transform in ancestor_transforms:
+        effect.ancestor_transforms[nodes[i] if i is not None else effect.document.getroot()] = transform
+    before = [e.attrib.items() for e in nodes]
+
+    effect.snap_elements([nodes[i] for i in selected])
+
+    changes = [(i, e.attrib.items()) for i, e in enumerate(nodes) if e.attrib.items() != before[i]]
+    cached = (0, 0)
+    if effect.cache is not None:
+        effect.cache.close()
+        cached = effect.cache.hits, effect.cache.misses
+    index = dict((e, i) for i, e in enumerate(nodes))
+    late = [index[e] for e in effect.unsnapped], [index[e] for e in effect.unshaped]
+    return changes, [str(e) for e in effect.errors], effect.stats.enabled and effect.stats.report() or None, cached, late
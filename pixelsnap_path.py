@@ -0,0 +1,340 @@
+"""
+PixelSnap's parsed path data (PathGeometry), and the numpy arithmetic for
+measuring curves. pixelsnap.py only imports this when a path's nodes are
+snapped or measured, which --modify_shapes=size_only never does.
+"""
+
+from __future__ import division
+
+import re
+import numpy
+
+from pixelsnap import Affine, Precision, format_number
+
+def round_half_away(values):
+    """ Rounds an array like Python's round() does: halves go away from zero
+        (2.5 -> 3.0), not to the nearest even number as numpy.round does.
+    """
+    magnitude = numpy.abs(values)
+    whole = numpy.floor(magnitude)
+    return numpy.copysign(whole + (magnitude - whole >= 0.5), values)
+
+def bezier_extrema(controls):
+    """ The points where each of a batch of bezier curves turns back in x or
+        y (where dx/dt or dy/dt is 0), or the curve's start point where there's
+        no such point. controls is a list of Nx2 arrays: [start, handle, end]
+        for quadratic curves, or [start, handle, handle, end] for cubic ones.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if len(controls) == 3:
+            p0, p1, p2 = controls
+            roots = [(p0 - p1) / (p0 - 2*p1 + p2)]
+        else:
+            # dB/dt is 3 times a quadratic, a*t^2 + b*t + c, solved in a way
+            # that doesn't lose precision when a is (close to) 0
+            p0, p1, p2, p3 = controls
+            a = -p0 + 3*p1 - 3*p2 + p3
+            b = 2 * (p0 - 2*p1 + p2)
+            c = p1 - p0
+            discriminant = b*b - 4*a*c
+            q = -0.5 * (b + numpy.copysign(numpy.sqrt(numpy.maximum(discriminant, 0)), b))
+            roots = [numpy.where(discriminant >= 0, q / a, numpy.nan), numpy.where(discriminant >= 0, c / q, numpy.nan)]
+
+    coefficients = len(controls) == 3 and (1, 2, 1) or (1, 3, 3, 1)
+    extrema = []
+    for root in roots:
+        for axis in (0, 1):
+            t = root[:, axis]
+            t = numpy.where((t > 0) & (t < 1), t, 0)[:, None]        # t=0 is the start point, which is in the bounding box anyway
+            degree = len(controls) - 1
+            extrema.append(sum(k * (1-t)**(degree-i) * t**i * p
+                               for i, (k, p) in enumerate(zip(coefficients, controls))))
+    return numpy.concatenate(extrema)
+
+class PathGeometry(object):
+    """ Every point of a parsed path (endpoints and bezier handles) held in a
+        single Nx2 array, so that translating, scaling and measuring a path is
+        one batched operation instead of a Python loop over each node.
+
+        segtypes[i] is the (absolute) segment type of segment i, and its points
+        are points[offsets[i]:offsets[i+1]] -- the last of them is the endpoint.
+        Arc radii, rotation & flags aren't points, so they're kept apart in
+        arc_params. Transforms leave them alone (as they always have), but
+        scale() scales arcs' radii along with their ends.
+
+        The subpaths are indexed as the path is parsed: subpaths[k] is the
+        (start, end) range of segments in subpath k, starting with its 'M'
+        (and ending with its 'Z', if it's closed), and subpath_of[i] is the
+        subpath that segment i belongs to. ends[i] is the index into points of
+        segment i's endpoint, which for a 'Z' is its subpath's starting point.
+    """
+    def __init__(self, path):
+        """ path is a list as returned by simplepath.parsePath, which only
+            gives us absolute M, L, C, Q, A & Z segments (H, V, S & T are
+            normalised away)
+        """
+        self.segtypes = []
+        self.arc_params = {}
+        self.subpaths = []
+        self.subpath_of = []
+        offsets = [0]
+        ends = []
+        coords = []
+        for i, (segtype, params) in enumerate(path):
+            segtype = segtype.upper()
+            if segtype == 'A':
+                self.arc_params[i] = list(params[:5])
+                params = params[5:]
+            self.segtypes.append(segtype)
+            coords.extend(params)
+            offsets.append(len(coords) // 2)
+
+            if segtype == 'M' or not self.subpaths:
+                self.subpaths.append((i, i+1))
+            self.subpaths[-1] = self.subpaths[-1][0], i+1
+            self.subpath_of.append(len(self.subpaths) - 1)
+            if segtype == 'Z': ends.append(ends[self.subpaths[-1][0]])
+            else: ends.append(offsets[-1] - 1)
+
+        self.offsets = numpy.array(offsets, dtype=int)
+        self.ends = ends
+        self.points = numpy.array(coords, dtype=float).reshape(-1, 2)
+
+    @classmethod
+    def from_points(cls, points, closed=False):
+        """ A single subpath of straight segments through points (an n x 2
+            array), as drawn by a <polyline> or <line>, or a <polygon> if closed
+        """
+        path = cls.__new__(cls)
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(points)
+        path.segtypes = n and ['M'] + ['L'] * (n - 1) + (closed and ['Z'] or []) or []
+        path.arc_params = {}
+        path.subpaths = n and [(0, len(path.segtypes))] or []
+        path.subpath_of = [0] * len(path.segtypes)
+        path.offsets = numpy.concatenate([numpy.arange(n + 1), closed and n and [n] or []]).astype(int)
+        path.ends = range(n) + (closed and n and [0] or [])
+        path.points = points
+        return path
+
+    def to_path(self):
+        """ Returns the path as a list suitable for simplepath.formatPath """
+        path = []
+        coords = self.points.tolist()                           # plain floats, so they format the same as simplepath's
+        offsets = self.offsets.tolist()
+        for i, segtype in enumerate(self.segtypes):
+            params = []
+            for xy in coords[offsets[i]:offsets[i+1]]:
+                params.extend(xy)
+            if segtype == 'A': params = self.arc_params[i] + params
+            path.append([segtype, params])
+        return path
+
+    def format(self, digits=Precision, relative=False):
+        """ Returns compact path data, a faster & smaller alternative to
+            simplepath.formatPath(self.to_path()): numbers are rounded to the
+            given number of decimal places (whole numbers are written without
+            a decimal point), repeated command letters are left out, and
+            coordinates can be relative to the current point. The numbers are
+            rounded & converted to strings in bulk.
+        """
+        points = numpy.round(self.points, digits) + 0.0        # + 0.0 turns -0.0 into 0.0
+        counts = self.offsets[1:] - self.offsets[:-1]
+        if relative:
+            # Relative to the rounded absolute points, and rounded again, so
+            # that the rounding errors don't add up along the path
+            starts = numpy.zeros((len(self.segtypes), 2))
+            starts[1:] = points[self.ends[:-1]]
+            points = numpy.round(points - numpy.repeat(starts, counts, axis=0), digits) + 0.0
+        numbers = map(repr, points.ravel().tolist())
+
+        # A command letter can be left out if it's the same as the last one
+        # (or an 'L' after an 'M'). The letters, and arcs' other parameters,
+        # are stuck onto the numbers either side of them, then it's all joined
+        current = None
+        first = (self.offsets * 2).tolist()
+        for i, segtype in enumerate(self.segtypes):
+            command = relative and segtype.lower() or segtype
+            if segtype == 'Z':                          # closing segments have no numbers of their own
+                if first[i]: numbers[first[i]-1] += command
+                current = None
+                continue
+            prefix = command != current and command or ''
+            if segtype == 'A':
+                arc = self.arc_params[i]
+                prefix += ' '.join([format_number(p, digits) for p in arc[:3]] + [str(int(p)) for p in arc[3:]]) + ' '
+            if prefix: numbers[first[i]] = prefix + numbers[first[i]]
+            current = segtype == 'M' and (relative and 'l' or 'L') or command
+
+        d = (' '.join(numbers) + ' ').replace('.0 ', ' ').replace('.0Z', 'Z').replace('.0z', 'z').replace(' -', '-')
+        return re.sub(' (?=[MLCQAZmlcqaz])', '', d).strip()
+
+    def __len__(self):
+        return len(self.segtypes)
+
+    def copy(self):
+        """ Returns a copy that can be snapped without changing this one.
+            Only the points & arc parameters are ever modified, so the
+            segment indexes are shared.
+        """
+        path = PathGeometry.__new__(PathGeometry)
+        path.segtypes, path.subpaths, path.subpath_of = self.segtypes, self.subpaths, self.subpath_of
+        path.offsets, path.ends = self.offsets, self.ends
+        path.arc_params = dict((i, list(params)) for i, params in self.arc_params.iteritems())
+        path.points = self.points.copy()
+        return path
+
+    def next_nodes(self):
+        """ The index of the node after each node. Each subpath is its own
+            loop: its last node leads back to its first. (That's all that's
+            per subpath: snap_path_intent still snaps a compound path's
+            subpaths together, not as if they were separate paths.)
+        """
+        subpaths = numpy.array(self.subpaths, dtype=int).reshape(-1, 2)[self.subpath_of]
+        start, length = subpaths[:, 0], subpaths[:, 1] - subpaths[:, 0]
+        return start + (numpy.arange(len(self)) + 1 - start) % numpy.where(length, length, 1)
+
+    def endpoint_index(self, i):
+        """ Index into points of the endpoint of segment i. A 'Z' segment
+            returns to the start of the current subpath, so its endpoint is
+            the subpath's 'M' node's.
+        """
+        return self.ends[i]
+
+    def closed(self, k):
+        """ Whether subpath k ends with a 'Z' (closing) segment """
+        return self.segtypes[self.subpaths[k][1] - 1] == 'Z'
+
+    def endpoints(self):
+        """ The endpoint of each segment that has one ('Z' segments don't --
+            they return to a point that's already in the list)
+        """
+        ends = self.offsets[1:] - 1
+        return self.points[ends[self.offsets[1:] > self.offsets[:-1]]]
+
+    def apply_transform(self, transform):
+        """ Transforms every point, including handles, in place """
+        self.points = transform.apply_array(self.points)
+
+    def translate(self, dx, dy):
+        self.apply_transform(Affine(e=dx, f=dy))
+
+    def translate_segments(self, offsets):
+        """ Shifts the points of each segment by that segment's own offset
+            (offsets is a list or array of [dx, dy], one per segment)
+        """
+        counts = self.offsets[1:] - self.offsets[:-1]
+        self.points += numpy.repeat(numpy.asarray(offsets, dtype=float).reshape(-1, 2), counts, axis=0)
+
+    def scale(self, sx, sy, origin=(0, 0)):
+        """ Scales the path about the given origin. Arcs' radii are scaled
+            too, so that they still bulge out as far relative to their ends
+            (exactly, unless the scaling is non-uniform and an arc's ellipse
+            is rotated other than by a multiple of 90 degrees, when both its
+            radii get the average scale).
+        """
+        self.apply_transform(Affine(sx, 0, 0, sy, origin[0] - sx*origin[0], origin[1] - sy*origin[1]))
+        for params in self.arc_params.itervalues():
+            rotation = params[2] % 180
+            if rotation == 0: scale = abs(sx), abs(sy)
+            elif rotation == 90: scale = abs(sy), abs(sx)
+            else: scale = (abs(sx*sy) ** 0.5,) * 2
+            params[0] *= scale[0]
+            params[1] *= scale[1]
+            if sx*sy < 0: params[4] = 1 - params[4]         # mirrored, so the arc sweeps the other way
+
+    def bounding_box(self, transform=None):
+        """ Returns [min_x, min_y], [max_x, max_y] of the (transformed) path,
+            or None if the path has no nodes. This is the true extent of the
+            path, including where curves & arcs bulge out past their nodes,
+            worked out for all of the path's curves & arcs at once.
+        """
+        if transform is None: transform = Affine()
+        has_points = self.offsets[1:] > self.offsets[:-1]
+        if not has_points.any(): return None
+
+        # An affine transform of a bezier curve is the same curve as the one
+        # through its transformed control points, so transform first
+        points = transform.apply_array(self.points)
+        ends = numpy.array(self.ends, dtype=int)
+        extents = [points[ends[has_points]]]
+        segtypes = numpy.array(self.segtypes)
+        for segtype, handles in (('Q', 1), ('C', 2)):
+            segs = numpy.nonzero(segtypes == segtype)[0]
+            segs = segs[segs > 0]
+            if not len(segs): continue
+            controls = [points[ends[segs-1]]] + [points[self.offsets[segs] + k] for k in range(handles + 1)]
+            extents.append(bezier_extrema(controls))
+        if self.arc_params:
+            extents.append(self.arc_extrema(transform))
+
+        extents = numpy.concatenate(extents)
+        return extents.min(axis=0).tolist(), extents.max(axis=0).tolist()
+
+    def control_box(self, transform=None):
+        """ Like bounding_box, but the box around the path's nodes & handles,
+            which a bezier curve never leaves: cheaper, and as tight unless
+            the path has curves. Arcs do bulge out past their ends, so a path
+            with arcs gets its bounding_box.
+        """
+        if self.arc_params: return self.bounding_box(transform)
+        if not len(self.points): return None
+        points = (transform or Affine()).apply_array(self.points)
+        return points.min(axis=0).tolist(), points.max(axis=0).tolist()
+
+    def arc_extrema(self, transform):
+        """ The points where each (transformed) arc segment reaches furthest in
+            x & y, or the arc's start point where it doesn't reach further
+            than its ends.
+
+            Each arc is converted to its centre parametrisation (see the SVG
+            spec's implementation notes, F.6.5), so that once transformed, it's
+                centre + A*cos(t) + B*sin(t)        for t from theta to theta+delta
+            in each of x & y, which is furthest out at t = atan2(B, A) (+pi).
+        """
+        arcs = numpy.array(sorted(self.arc_params), dtype=int)
+        arcs = arcs[arcs > 0]
+        params = numpy.array([self.arc_params[i] for i in arcs], dtype=float).reshape(-1, 5)
+        ends = numpy.array(self.ends, dtype=int)
+        start, end = self.points[ends[arcs-1]], self.points[ends[arcs]]
+        rx, ry = numpy.abs(params[:, 0]), numpy.abs(params[:, 1])
+        cos, sin = numpy.cos(numpy.radians(params[:, 2])), numpy.sin(numpy.radians(params[:, 2]))
+        large, sweep = params[:, 3] != 0, params[:, 4] != 0
+
+        half = (start - end) / 2
+        x1 = cos*half[:, 0] + sin*half[:, 1]
+        y1 = -sin*half[:, 0] + cos*half[:, 1]
+        curved = (rx > 0) & (ry > 0) & ((x1 != 0) | (y1 != 0))      # otherwise it's a straight line, or nothing at all
+        rx, ry = numpy.where(curved, rx, 1), numpy.where(curved, ry, 1)
+
+        grow = numpy.sqrt(numpy.maximum(1, (x1/rx)**2 + (y1/ry)**2))  # radii too small to reach the end are scaled up
+        rx, ry = rx*grow, ry*grow
+        numerator = (rx*ry)**2 - (rx*y1)**2 - (ry*x1)**2
+        denominator = (rx*y1)**2 + (ry*x1)**2
+        coef = numpy.sqrt(numpy.maximum(0, numerator / numpy.where(denominator, denominator, 1)))
+        coef = numpy.where(large == sweep, -coef, coef)
+        cx1, cy1 = coef*rx*y1/ry, -coef*ry*x1/rx
+        centre = numpy.column_stack((cos*cx1 - sin*cy1, sin*cx1 + cos*cy1)) + (start + end) / 2
+
+        theta = numpy.arctan2((y1-cy1)/ry, (x1-cx1)/rx)
+        delta = numpy.arctan2((-y1-cy1)/ry, (-x1-cx1)/rx) - theta
+        delta = numpy.where(sweep & (delta < 0), delta + 2*numpy.pi, delta)
+        delta = numpy.where(~sweep & (delta > 0), delta - 2*numpy.pi, delta)
+
+        # The transformed ellipse's axes: the transform applied to (rx, 0) &
+        # (0, ry), rotated by the arc's x-axis-rotation
+        t = transform
+        A = numpy.column_stack(((t.a*cos + t.c*sin)*rx, (t.b*cos + t.d*sin)*rx))
+        B = numpy.column_stack(((t.c*cos - t.a*sin)*ry, (t.d*cos - t.b*sin)*ry))
+        centre = transform.apply_array(centre)
+        start = transform.apply_array(start)
+
+        extrema = []
+        for axis in (0, 1):
+            furthest = numpy.arctan2(B[:, axis], A[:, axis])
+            for angle in (furthest, furthest + numpy.pi):
+                along = numpy.where(delta >= 0, angle - theta, theta - angle) % (2*numpy.pi)
+                on_arc = curved & (along <= numpy.abs(delta))
+                point = centre + A*numpy.cos(angle)[:, None] + B*numpy.sin(angle)[:, None]
+                extrema.append(numpy.where(on_arc[:, None], point, start))
+        return numpy.concatenate(extrema)
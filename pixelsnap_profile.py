@@ -0,0 +1,67 @@
+"""
+PixelSnap's --profile_report: times the phases of a run and counts things
+along the way. pixelsnap.py only imports this when a report is asked for.
+"""
+
+import sys, time, json
+
+class Instrumentation(object):
+    """ Records the wall time spent in each phase of a run, and counts things
+        along the way, for --profile_report. Phases can nest (e.g. parsing
+        is timed separately, inside the stage that needed it), so their
+        times don't necessarily add up to the total.
+    """
+    enabled = True
+
+    class Phase(object):
+        __slots__ = ('stats', 'name', 'start')
+        def __init__(self, stats, name):
+            self.stats, self.name = stats, name
+        def __enter__(self):
+            self.start = time.time()
+        def __exit__(self, *exc_info):
+            seconds, calls = self.stats.phases.get(self.name, (0, 0))
+            self.stats.phases[self.name] = seconds + time.time() - self.start, calls + 1
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}                # name -> (seconds, calls)
+        self.counters = {}
+        self.errors = {}                # TransformError message -> count
+        self.unfinished = {}            # 'unsnapped' & 'unshaped' -> ids of what --time_budget left undone
+
+    def phase(self, name):
+        """ Use as: with stats.phase(name): ... """
+        return self.Phase(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, e):
+        self.errors[str(e)] = self.errors.get(str(e), 0) + 1
+
+    def merge(self, report):
+        """ Adds the phases & counters of another process's report() to ours """
+        for name, phase in report['phases'].iteritems():
+            seconds, calls = self.phases.get(name, (0, 0))
+            self.phases[name] = seconds + phase['seconds'], calls + phase['calls']
+        for name, n in report['counters'].iteritems():
+            self.count(name, n)
+
+    def report(self):
+        return {
+            'total_seconds': time.time() - self.start,
+            'phases': dict((name, {'seconds': seconds, 'calls': calls})
+                           for name, (seconds, calls) in self.phases.iteritems()),
+            'counters': self.counters,
+            'transform_errors': self.errors,
+            'unfinished': self.unfinished,
+        }
+
+    def write(self, filename):
+        """ Writes the report as JSON to filename, or to stderr if it's '-' """
+        report = json.dumps(self.report(), indent=2, sort_keys=True)
+        if filename == '-':
+            print >>sys.stderr, report
+        else:
+            open(filename, 'w').write(report + '\n')
@@ -0,0 +1,257 @@
+"""
+PixelSnap's --modify_shapes=shape: snaps the nodes of a path (rather than only
+its bounding box) so that its straight vertical & horizontal segments land on
+pixel boundaries. pixelsnap.py only imports this in that mode.
+"""
+
+from __future__ import division
+
+import sys
+import numpy
+
+from pixelsnap import Affine, Precision, TransformError, transform_dimensions, transform_point
+from pixelsnap_path import round_half_away
+
+def straight_segments(effect, transformed, next_node, axis):
+    """ vertical() (axis=0) or horizontal() (axis=1) for a whole array of
+        transformed nodes at once: whether the segment from each node to
+        the next runs along that axis, to within max_gradient.
+    """
+    across = numpy.abs(transformed[:, axis] - transformed[next_node, axis])
+    along = numpy.abs(transformed[:, 1-axis] - transformed[next_node, 1-axis])
+    if axis == 1:                                   # as in horizontal()
+        across = round_half_away(across * 10**Precision) / 10**Precision
+        along = round_half_away(along * 10**Precision) / 10**Precision
+    gradient = across / numpy.where(along == 0, 1, along)
+    return numpy.where(along == 0, across == 0, gradient < effect.options.max_gradient/100)
+
+def snap_intent_segments(effect, transformed, snapped, next_node, axis, distance, snapped_distance):
+    """ The first half of snap_path_intent's work along one axis: snaps the
+        positions of vertical segments (axis=0) or horizontal segments
+        (axis=1) relative to each other. Updates snapped[:, axis] in
+        place, and records each straight segment's distance from the one
+        before it (and its snapped distance) in distance & snapped_distance.
+
+        Returns (straight, on_straight, order, rank, accepted) for
+        distribute_intent_nodes, where accepted lists the straight
+        segments that were snapped, in order along the axis.
+    """
+    pos = transformed[:, axis]
+    direction = transformed[:, 1-axis] - transformed[next_node, 1-axis]
+    straight = straight_segments(effect, transformed, next_node, axis)
+    on_straight = numpy.empty_like(straight)
+    on_straight[next_node] = straight               # whether the segment leading to each node is straight
+    order = numpy.argsort(pos, kind='mergesort')    # stable, so nodes in the same place stay in path order
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+
+    # Go through the straight segments in order along the axis. If segments
+    # are the same direction, allow snapping to zero width, otherwise don't
+    # snap when < 0.5 (and measure the next segment from the previous one)
+    accepted, rejected, measured, measured_from = [], [], [], []
+    positions, directions = pos.tolist(), direction.tolist()
+    prev = None
+    for i in order[straight[order]].tolist():
+        if prev is not None:
+            measured.append(i)
+            measured_from.append(prev)
+            if directions[i] != directions[prev] and abs(positions[i] - positions[prev]) < 0.5:
+                rejected.append(i)                  # Pretend it's not straight after this
+                continue
+        accepted.append(i)
+        prev = i
+    straight[rejected] = False
+    on_straight[next_node[rejected]] = False
+    accepted = numpy.array(accepted, dtype=int)
+    distance[measured] = pos[measured] - pos[measured_from]
+    if not len(accepted): return straight, on_straight, order, rank, accepted
+
+    # Each segment's snapped position is the previous one's plus the
+    # rounded distance between them. The node at the far end of each
+    # segment is set equal to it, so that almost-straight segments (slope
+    # < max_gradient) are certain to be made straight. Where a node is
+    # set more than once, the last in order along the axis wins.
+    snapped_distance[accepted[1:]] = round_half_away(distance[accepted[1:]])
+    positions = numpy.cumsum(numpy.concatenate((pos[accepted[:1]], snapped_distance[accepted[1:]])))
+    targets = numpy.concatenate((accepted[1:], next_node[accepted]))
+    values = numpy.concatenate((positions[1:], positions))
+    when = numpy.concatenate((rank[accepted[1:]], rank[accepted]))
+    latest = numpy.argsort(when, kind='mergesort')[::-1]
+    targets, first = numpy.unique(targets[latest], return_index=True)
+    snapped[targets, axis] = values[latest][first]
+
+    return straight, on_straight, order, rank, accepted
+
+def distribute_intent_nodes(effect, transformed, snapped, axis, segments, distance, snapped_distance):
+    """ The second half of snap_path_intent's work along one axis: moves
+        each in-between node according to the amount the last straight
+        segment before it (in order along the axis) was shifted & scaled.
+        segments is what snap_intent_segments returned for the axis.
+    """
+    straight, on_straight, order, rank, accepted = segments
+    if not len(accepted): return
+    pos = transformed[:, axis]
+
+    next_distance = distance[accepted[1:]]
+    scale = numpy.ones(len(pos))
+    scale[accepted[:-1]] = snapped_distance[accepted[1:]] / numpy.where(next_distance, next_distance, 1)
+    scale[accepted[:-1][next_distance == 0]] = 1
+
+    anchor = straight & ~on_straight
+    between = ~straight & ~on_straight
+    last_anchor = numpy.maximum.accumulate(numpy.where(anchor[order], numpy.arange(len(order)), -1))[rank]
+    nodes = numpy.nonzero(between & (last_anchor >= 0))[0]
+    anchors = order[last_anchor[nodes]]
+    origin = pos[anchors]
+    shift = snapped[anchors, axis] - pos[anchors]
+    snapped[nodes, axis] = (snapped[nodes, axis] - origin) * scale[anchors] + origin + shift
+
+def snap_path_intent(effect, elem, parent_transform=None, path=None):
+    """ Like snap_path_shape, but preserves widths, making it much better
+        for delicate shapes like fonts (ideally this could act like an auto
+        hinting algorithm). The idea is to obselete the original snap_path_shape
+        altogether.
+        
+        We assume the position of the path has already been snapped to
+        a pixel boundary (i.e. we calculate all widths relative to the edge
+        of the path).
+        
+        The nodes are held in arrays, one entry per node, so that each step
+        (classifying segments, ordering nodes, moving the in-between nodes)
+        is done for every node at once: for each axis, snap_intent_segments
+        snaps the straight segments, then distribute_intent_nodes moves the
+        nodes in between.
+
+        Only the loops are per subpath (see PathGeometry.next_nodes): the
+        straight segments of every subpath are ordered & snapped along each
+        axis together, and the whole path is shifted by its first straight
+        segment. So the widths between the subpaths of a compound path are
+        snapped too, and it can come out differently from the same subpaths
+        snapped as separate paths.
+
+        Note: to preserve shape in some special cases (eg very thin font
+        strokes) any widths that snap to 0 we should snap to 0.5, but calculate
+        the subsequent width relative to the previous segment.
+    """
+    own_path = path is None
+    if own_path: path = effect.path_geometry(elem)
+
+    transform = effect.get_transform(elem, parent_transform)
+
+    if transform.skewed():                          # if we've got any skew/rotation, get outta here
+        raise TransformError("Selection contains transformations with skew/rotation")
+    
+    stroke_offset = effect.stroke_width_offset(elem, parent_transform)
+
+    # The transformed location of each of the path's nodes, including the
+    # endpoint node (which equals the first node) of a closed subpath
+    transformed = transform.apply_array(path.points[path.ends])
+    snapped = transformed.copy()
+
+    next_node = path.next_nodes()
+
+    # Snap the vertical segments, then the horizontal ones, then distribute
+    # the nodes in between. Each node has a single distance (& snapped
+    # distance) that both directions record into, as they always have:
+    # the horizontal pass overwrites the vertical one's, and distributing
+    # along the vertical segments then sees the horizontal distances.
+    distance = numpy.zeros(len(path))
+    snapped_distance = numpy.zeros(len(path))
+    segments = [snap_intent_segments(effect, transformed, snapped, next_node, axis, distance, snapped_distance)
+                for axis in (0, 1)]
+    for axis in (0, 1):
+        distribute_intent_nodes(effect, transformed, snapped, axis, segments[axis], distance, snapped_distance)
+    first_vertical, first_horizontal = [accepted[0] if len(accepted) else None
+                                        for straight, on_straight, order, rank, accepted in segments]
+
+    # Calculate the distance required to snap the first horizontal & vertical
+    # segments to a pixel, and shift the whole path accordingly.
+    # (Like snap_path_pos, but relative to the first straight segment, not
+    # the bounding box)
+    x_offset = 0
+    y_offset = 0
+    if first_horizontal is not None:
+        y = snapped[first_horizontal, 1]
+        y_offset = round(y) - y + effect.document_offset
+    if first_vertical is not None:
+        x = snapped[first_vertical, 0]
+        x_offset = round(x) - x
+
+    snapped[:, 0] += x_offset + stroke_offset
+    snapped[:, 1] += y_offset + stroke_offset
+
+    # Finally move each node of the actual path by the amount it's moved
+    inverse = transform.inverse()
+    path.translate_segments((snapped - transformed) * (inverse.a, inverse.d))
+
+    if own_path: effect.write_path(elem, path)
+
+def snap_path_shape(effect, elem, parent_transform=None, path=None):
+    """ Goes through each node in the given path and shifts it to the
+        nearest pixel boundary. This would normally be done after
+        the path is shifted & scaled into position, to make sure the
+        least intrusive modifications are done first -- often the shape
+        won't need to be snapped at all, if a shift/scale was successful.
+    """
+
+    own_path = path is None
+    if own_path: path = effect.path_geometry(elem)
+
+    transform = effect.get_transform(elem, parent_transform)
+
+    if transform.skewed():                          # if we've got any skew/rotation, get outta here
+        raise TransformError("Selection contains transformations with skew/rotation")
+    
+    offset = effect.stroke_width_offset(elem, parent_transform) % 1
+    
+    for k, (start, end) in enumerate(path.subpaths):       # Each subpath is snapped as a closed loop of its own
+        length = end - start
+        prev_xy = effect.pathxy(path, end-1)
+        first_xy = effect.pathxy(path, start)
+        for i in range(start, end):
+            xy = effect.pathxy(path, i)
+            if (i == end-1) or \
+               ((i == end-2) and path.closed(k)):
+                next_xy = first_xy
+            else:
+                next_xy = effect.pathxy(path, i+1)
+            
+            if not (xy and prev_xy and next_xy):
+                print >>sys.stderr, "xy=%s, prev_xy=%s, next_xy=%" % (xy, prev_xy, next_xy)
+                prev_xy = xy
+                continue
+            
+            xy_untransformed = tuple(xy)
+            xy = list(transform_point(transform, xy))
+            prev_xy = transform_point(transform, prev_xy)
+            next_xy = transform_point(transform, next_xy)
+            
+            on_vertical = on_horizontal = False
+            
+            if effect.horizontal(xy, prev_xy):
+                if length > 2 or i==start:              # on 2-point paths, first.next==first.prev==last and last.next==last.prev==first
+                    xy[1] = prev_xy[1]                  # make the almost-equal values equal, so they round in the same direction
+                on_horizontal = True
+            if effect.horizontal(xy, next_xy):
+                on_horizontal = True
+            
+            if effect.vertical(xy, prev_xy):                   # as above
+                if length > 2 or i==start:
+                    xy[0] = prev_xy[0]
+                on_vertical = True
+            if effect.vertical(xy, next_xy):
+                on_vertical = True
+
+            prev_xy = tuple(xy_untransformed)
+            
+            fractional_offset = [0,0]
+            if on_vertical:
+                fractional_offset[0] = xy[0] - (round(xy[0]-offset) + offset)
+            if on_horizontal:
+                fractional_offset[1] = xy[1] - (round(xy[1]-offset) + offset) - effect.document_offset
+            
+            fractional_offset = transform_dimensions(transform, fractional_offset[0], fractional_offset[1], inverse=True)
+            effect.transform_path_node(Affine(e=-fractional_offset[0], f=-fractional_offset[1]), path, i)
+
+
+    if own_path: effect.write_path(elem, path)
@@ -0,0 +1,216 @@
+"""
+PixelSnap's --stream: snaps a document as it's read, writing it out as it
+goes, for documents too big to hold in memory. pixelsnap.py only imports
+this when streaming.
+"""
+
+import shutil, tempfile
+
+import inkex
+
+from pixelsnap import Snappable, StrokeProperties, Stylesheet, TransformError, elemtype, unittouu
+from pixelsnap_xml import StreamWriter
+
+class StreamedElement(object):
+    """ A layer or group that snap_stream is inside of. kind is 'ancestor'
+        (snapped as an ancestor of the selection, see plan_ancestors),
+        'group' (selected, or in a selected group) or 'plain' (in a group
+        that couldn't be snapped). A group is snapped relative to
+        parent_transform, & its children relative to transform, which is
+        set when it's opened: when its start tag is written.
+    """
+    __slots__ = ('elem', 'kind', 'parent_transform', 'transform', 'opened')
+
+    def __init__(self, elem, kind, parent_transform=None):
+        self.elem, self.kind, self.parent_transform = elem, kind, parent_transform
+        self.transform, self.opened = None, False
+
+def snap_stream(effect, source, stream):
+    """ Snaps the document in source (a file) as it's read, writing it to
+        stream as it goes, for documents too big to hold in memory: only
+        the layers & groups we're inside of, and the element being
+        read, are kept. The elements snapped are those --select_all and
+        --id would select.
+
+        Each element is read whole, snapped when its end tag is seen,
+        written & freed -- apart from layers & groups, which hold
+        everything else. Their start tags are written when their first
+        child is seen, having snapped them (see open_streamed), so that
+        their children can then be written & freed one by one. With
+        --id, source is read twice: first to find the layers & groups
+        that hold selected elements (see selection_ancestors), which are
+        snapped as ancestors of the selection (see plan_ancestors), while
+        the rest are copied as they are. With --select_all, every layer
+        is such an ancestor. <style> rules only apply to the elements
+        after them.
+    """
+    if effect.options.profile_report:
+        import pixelsnap_profile
+        effect.stats = pixelsnap_profile.Instrumentation()
+    if effect.options.cache_file:
+        import pixelsnap_cache
+        effect.cache = pixelsnap_cache.ResultCache(effect.options.cache_file, effect.options.cache_size)
+    writer = StreamWriter(stream)
+    ids = set(effect.options.ids)
+    ancestors = None                                                # the starts of the layers & groups holding selected elements
+    if ids and not effect.options.select_all:
+        source = rewindable(source)
+        position = source.tell()
+        ancestors = selection_ancestors(source, ids)
+        source.seek(position)
+    started = -1                                                    # how many start tags have been read, less one
+    groups = []                                                     # a StreamedElement for each layer & group we're in
+    whole = None                                                    # the element being read whole, and whether to snap it
+
+    for event, elem in inkex.etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            started += 1
+            ancestor = ancestors is None or started in ancestors    # whether it might hold selected elements
+        if whole is not None:
+            if event == 'end' and elem is whole[0]:
+                write_streamed(effect, elem, whole[1] and groups[-1], writer)
+                whole = None
+        elif event == 'end':
+            close_streamed(effect, groups.pop(), writer)
+        elif not groups:                                            # the root element
+            effect.document_offset = unittouu(elem.attrib['height']) % 1 if effect.options.ancestor_offset else 0
+            effect.stylesheet = Stylesheet(elem, StrokeProperties)
+            if effect.options.remember_snaps: effect.declare_namespace(elem)
+            writer.prolog(elem)
+            groups.append(StreamedElement(elem, ancestor and 'ancestor' or 'plain'))
+            root = elem
+        else:
+            parent = groups[-1]
+            open_streamed(effect, parent, writer, elem)
+            flush_streamed(effect, parent, writer, elem)
+            kind = streamed_kind(effect, parent, elem, ids, ancestor)
+            if kind in ('snap', 'copy'):
+                whole = elem, kind == 'snap'
+            else:
+                groups.append(StreamedElement(elem, kind, parent.transform if parent.kind == 'group' else None))
+
+    writer.epilog(root)
+    effect.finish()
+
+def selection_ancestors(source, ids):
+    """ The layers & groups in source (a file) that hold elements with
+        the given ids, as the numbers of their start tags in document
+        order (the root's being 0). Elements are freed as they're read,
+        so only the ones we're inside of are kept.
+    """
+    ancestors, open_starts = set(), []
+    started = -1
+    for event, elem in inkex.etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            started += 1
+            if open_starts and elemtype(elem, Snappable) and elem.get('id') in ids: ancestors.update(open_starts)
+            open_starts.append(started)
+        else:
+            open_starts.pop()
+            elem.clear()
+            parent = elem.getparent()                               # None for the root, which may follow comments
+            while parent is not None and elem.getprevious() is not None: del parent[0]
+    return ancestors
+
+def rewindable(source):
+    """ source (a file), or, if it can't be read twice (a pipe), a copy
+        of it in a temporary file
+    """
+    try:
+        source.seek(source.tell())
+        return source
+    except IOError:
+        spool = tempfile.TemporaryFile()
+        shutil.copyfileobj(source, spool)
+        spool.seek(0)
+        return spool
+
+def streamed_kind(effect, parent, elem, ids, ancestor=True):
+    """ What snap_stream does with elem, a child of parent (a
+        StreamedElement): opens it, if it's a layer or group (see
+        StreamedElement for the kinds), or reads it whole to 'snap' or
+        'copy' it. An unselected layer or group is opened as an
+        'ancestor' if it holds selected elements (or might: ancestor),
+        or copied as it is, 'plain'.
+    """
+    if parent.kind != 'ancestor':
+        snap = parent.kind == 'group' and not isinstance(parent.transform, TransformError)
+        if elemtype(elem, 'g'): return snap and 'group' or 'plain'
+        return snap and elemtype(elem, Snappable) and 'snap' or 'copy'
+
+    layer = elemtype(elem, 'g') and elem.get(inkex.addNS('groupmode', 'inkscape')) == 'layer'
+    selected = elemtype(elem, Snappable) and (elem.get('id') in ids or (effect.options.select_all and not layer))
+    if elemtype(elem, 'g'): return selected and 'group' or ancestor and 'ancestor' or 'plain'
+    return selected and 'snap' or 'copy'
+
+def open_streamed(effect, group, writer, child=None):
+    """ Snaps a layer or group (as plan_ancestors or snap_object would)
+        and writes its start tag, when its first child is seen, if that
+        hasn't been done yet. Without a child, it's empty, and is only
+        snapped: close_streamed writes it whole.
+    """
+    if group.opened: return
+    elem = group.elem
+    if group.kind == 'ancestor' and child is not None:
+        with effect.stats.phase('plan_ancestors'):
+            effect.plan_ancestors([child])
+    elif group.kind == 'group':
+        try:
+            effect.stats.count('elements visited')
+            parent_transform, context_transform = effect.parent_transforms(elem, group.parent_transform)
+            with effect.stats.phase('snap_translation'):
+                effect.snap_translation(elem)
+            group.transform = effect.get_transform(elem, parent_transform)
+        except TransformError, e:
+            effect.report_error(e)
+            group.transform = e
+    if child is not None: writer.start(elem)
+    group.opened = True
+
+def flush_streamed(effect, group, writer, upto=None):
+    """ Writes the tails of the children of a group up to upto (along
+        with any comments & processing instructions, which are only
+        seen here), and frees them
+    """
+    elem = group.elem
+    while len(elem) and elem[0] is not upto:
+        child = elem[0]
+        if not isinstance(child.tag, basestring): writer.element(child)
+        writer.tail(child)
+        del elem[0]
+
+def write_streamed(effect, elem, parent, writer):
+    """ Snaps an element that's been read whole (unless parent, its
+        StreamedElement, is None), writes it, and frees all but its tail
+    """
+    if parent:
+        try:
+            effect.snap_object(elem, parent.transform if parent.kind == 'group' else None)
+        except TransformError, e:
+            effect.report_error(e)
+    styles = list(elem.iter(inkex.addNS('style', 'svg')))
+    if styles:
+        for style in styles: effect.stylesheet.add(style)
+        effect.style_cache.clear()                                  # what's cached for the open groups may be out of date
+    writer.element(elem)
+    forget(effect, elem)
+
+def close_streamed(effect, group, writer):
+    elem = group.elem
+    if group.opened:
+        flush_streamed(effect, group, writer)
+        writer.end(elem)
+    else:                                                           # it's empty, or only holds comments
+        open_streamed(effect, group, writer)
+        writer.element(elem)
+    forget(effect, elem)
+
+def forget(effect, elem):
+    """ Frees what's cached for elem and everything in it, & all but its tail """
+    for e in elem.iter():
+        effect.style_cache.pop(e, None)
+        effect.transform_cache.pop(e, None)
+        effect.ancestor_transforms.pop(e, None)
+    tail = elem.tail
+    elem.clear()
+    elem.tail = tail
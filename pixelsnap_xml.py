@@ -0,0 +1,240 @@
+"""
+Writes SVG for PixelSnap without going through lxml's serializer: a document
+a piece at a time as it's snapped (StreamWriter, for --stream), or the input
+file with only the changed attributes patched into its bytes (write_patched,
+for --patch_output). pixelsnap.py only imports this when one of those is used.
+"""
+
+import os, re
+import inkex
+
+# What --patch_output needs to find each element's start tag (and its
+# attributes) in the input file's bytes, skipping over everything else
+MarkupRe = re.compile(r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!DOCTYPE(?:[^\[>]*\[.*?\])?[^>]*>|</[^>]*>|'
+                      r'<([^\s/>!?]+)((?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>', re.S)
+AttributeRe = re.compile(r'(\s+)([^\s=/>]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+EntityRe = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+Entities = {'amp': u'&', 'lt': u'<', 'gt': u'>', 'quot': u'"', 'apos': u"'"}
+EscapedRe = re.compile(u'[&<"\n\r\t]')
+
+def unescape_attribute(value):
+    """ An attribute value from an XML file (a UTF-8 string, without its
+        quotes) as a parser gives it, or None if it uses entities we don't know
+    """
+    value = value.decode('utf-8').replace(u'\r\n', u' ')
+    for c in u'\r\n\t': value = value.replace(c, u' ')                 # attribute value normalisation
+    if '&' in EntityRe.sub('', value): return None
+    def entity(match):
+        name = match.group(1)
+        if name.startswith('#x'): return unichr(int(name[2:], 16))
+        if name.startswith('#'): return unichr(int(name[1:]))
+        return Entities[name]
+    return EntityRe.sub(entity, value)
+
+def escape_attribute(value):
+    """ value, quoted & escaped for an XML file, as a UTF-8 string """
+    if not EscapedRe.search(value):
+        return '"%s"' % (isinstance(value, unicode) and value.encode('utf-8') or value)
+    if not isinstance(value, unicode): value = value.decode('utf-8')
+    for c, escaped in ((u'&', u'&amp;'), (u'<', u'&lt;'), (u'"', u'&quot;'),
+                       (u'\n', u'&#10;'), (u'\r', u'&#13;'), (u'\t', u'&#9;')):
+        value = value.replace(c, escaped)
+    return (u'"%s"' % value).encode('utf-8')
+
+class StreamWriter(object):
+    """ Writes a document out a piece at a time, for snap_stream: whole
+        elements, or the start & end tags of an element whose children are
+        written in between. Namespaces are only declared on the elements
+        where they come into scope, as they were in the input, rather than
+        on every element written.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.scopes = [{'xml': 'http://www.w3.org/XML/1998/namespace'}]    # prefix -> namespace, for each open element
+
+    def text(self, text):
+        if not text: return
+        if isinstance(text, unicode): text = text.encode('utf-8')
+        self.stream.write(text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'))
+
+    def tail(self, elem):
+        self.text(elem.tail)
+
+    def tag_name(self, elem):
+        local = inkex.etree.QName(elem).localname
+        return elem.prefix and '%s:%s' % (elem.prefix, local) or local
+
+    def start_tag(self, elem):
+        """ Returns elem's start tag, less its closing '>', & the namespaces in scope inside it """
+        scope = self.scopes[-1]
+        declared = sorted((p or '', ns) for p, ns in elem.nsmap.iteritems() if scope.get(p) != ns)
+        if declared:
+            scope = dict(scope)
+            for p, ns in declared: scope[p or None] = ns
+        parts = ['<', self.tag_name(elem)]
+        parts.extend(' xmlns%s=%s' % (p and ':' + p, escape_attribute(ns)) for p, ns in declared)
+        prefixes = None
+        for name, value in elem.attrib.iteritems():
+            if name[0] == '{':
+                if prefixes is None: prefixes = dict((ns, p) for p, ns in scope.iteritems() if p)
+                namespace, local = name[1:].split('}')
+                name = '%s:%s' % (prefixes[namespace], local)
+            parts.append(' %s=%s' % (name, escape_attribute(value)))
+        return ''.join(parts), scope
+
+    def start(self, elem):
+        """ Writes elem's start tag & text, for its children to be written after """
+        tag, scope = self.start_tag(elem)
+        self.stream.write(tag + '>')
+        self.scopes.append(scope)
+        self.text(elem.text)
+
+    def end(self, elem):
+        self.stream.write('</%s>' % self.tag_name(elem))
+        self.scopes.pop()
+
+    def element(self, elem):
+        """ Writes all of elem, apart from its tail """
+        if elem.tag is inkex.etree.Comment:
+            self.stream.write('<!--%s-->' % (elem.text or '').encode('utf-8'))
+        elif elem.tag is inkex.etree.ProcessingInstruction:
+            self.stream.write('<?%s?>' % ' '.join(filter(None, (elem.target, elem.text))).encode('utf-8'))
+        elif elem.tag is inkex.etree.Entity:
+            self.stream.write(elem.text.encode('utf-8'))
+        elif len(elem) or elem.text:
+            self.start(elem)
+            for child in elem:
+                self.element(child)
+                self.tail(child)
+            self.end(elem)
+        else:
+            self.stream.write(self.start_tag(elem)[0] + '/>')
+
+    def prolog(self, root):
+        """ Writes what comes before the root element: the XML declaration,
+            DOCTYPE and any comments & processing instructions
+        """
+        doctype = root.getroottree().docinfo.doctype
+        self.stream.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')      # as Inkscape writes it
+        if doctype: self.stream.write(doctype + '\n')
+        for sibling in reversed(list(root.itersiblings(preceding=True))):
+            self.element(sibling)
+            self.stream.write('\n')
+
+    def epilog(self, root):
+        for sibling in root.itersiblings():
+            self.stream.write('\n')
+            self.element(sibling)
+        self.stream.write('\n')
+def patch_splices(root, edits, data):
+    """ The sorted (start, end, replacement) byte ranges that
+        PixelSnapEffect.write_patched replaces in data (the input file's
+        bytes) to write the attributes in edits (element -> the names of the
+        attributes set on it), or None if the file & the document under root
+        don't line up.
+    """
+    elements = [e for e in root.iter() if isinstance(e.tag, basestring)]
+    targets = dict((i, e) for i, e in enumerate(elements) if e in edits)
+    last = targets and max(targets) or -1
+
+    splices = []                                                    # (start, end, replacement bytes)
+    scopes = [{'xml': 'http://www.w3.org/XML/1998/namespace'}]     # namespace declarations of each open element
+    k = -1
+    for match in MarkupRe.finditer(data):
+        if match.start(1) < 0:                                      # anything but a start tag
+            if data[match.start() + 1] == '/': scopes.pop()
+            continue
+        k += 1
+        scope = {}
+        if data.find('xmlns', match.start(2), match.end(2)) >= 0:
+            for space, name, value in AttributeRe.findall(match.group(2)):
+                if name == 'xmlns' or name.startswith('xmlns:'): scope[name[6:] or None] = unescape_attribute(value[1:-1])
+        if k == 0:                                                  # namespaces declared on the root since it was read (see PixelSnapEffect.declare_namespace)
+            declared = sorted((p, ns) for p, ns in elements[0].nsmap.iteritems() if p and scope.get(p) != ns)
+            if declared:
+                splices.append((match.end(2), match.end(2), ''.join(' xmlns:%s=%s' % (p, escape_attribute(ns)) for p, ns in declared)))
+                scope.update(declared)
+        if k > last: break
+        if not match.group(3): scopes.append(scope)
+
+        elem = targets.get(k)
+        if elem is None: continue
+        if match.group(1).split(':')[-1] != inkex.etree.QName(elem).localname: return None
+        scope = dict(pair for s in (match.group(3) and scopes + [scope] or scopes) for pair in s.iteritems())   # a self-closing tag's scope wasn't pushed
+        splices.extend(attribute_splices(elem, edits[elem], match, scope))
+    if k < last: return None
+    return sorted(splices)
+
+def attribute_splices(elem, edited, match, scope):
+    """ The (start, end, replacement) byte ranges to patch in elem's start
+        tag (the MarkupRe match), to change the attributes we've set on it
+        (edited, their names). scope is the namespace declarations it's in.
+    """
+    offset = match.start(2)
+    attributes = {}                                                 # qualified name -> (start, value start, end)
+    for m in AttributeRe.finditer(match.group(2)):
+        attributes[m.group(2)] = offset + m.start(), offset + m.start(3), offset + m.end()
+
+    splices, added = [], []
+    prefixes = dict((ns, p) for p, ns in scope.iteritems() if p)   # namespace -> a prefix for it
+    tag = match.group(0)
+    for name in [k for k in elem.attrib.keys() if k in edited] + [k for k in edited if k not in elem.attrib]:
+        if name[0] == '{':
+            namespace, local = name[1:].split('}')
+            if namespace not in prefixes:                           # lxml has declared it on the element, so we do too
+                prefixes[namespace] = [p for p, ns in elem.nsmap.iteritems() if ns == namespace and p][0]
+                added.append(' xmlns:%s=%s' % (prefixes[namespace], escape_attribute(namespace)))
+            qname = '%s:%s' % (prefixes[namespace], local)
+        else:
+            qname = name
+
+        value = elem.get(name)
+        if qname in attributes:
+            start, value_start, end = attributes[qname]
+            original = tag[value_start - match.start() + 1:end - match.start() - 1]
+            if value is None:
+                splices.append((start, end, ''))
+            elif value != original and value != unescape_attribute(original):
+                splices.append((value_start, end, escape_attribute(value)))
+        elif value is not None:
+            added.append(' %s=%s' % (qname, escape_attribute(value)))
+    if added: splices.append((match.end(2), match.end(2), ''.join(added)))
+    return splices
+
+def write_patched(effect, stream):
+    """ Writes the input file to stream with just the attributes we've
+        changed (see set_attribute) patched in, leaving every other byte
+        as it was. The input file is memory-mapped rather than read, and
+        only the start tags of elements are looked at: the k-th start tag
+        in the file is the k-th element in the document.
+
+        Returns False, having written nothing, if the document can't be
+        written this way: if it wasn't read from a file, isn't UTF-8, or
+        elements have been added or removed.
+    """
+    import mmap
+    svg_file = getattr(effect, 'svg_file', None)
+    if effect.edits is None or effect.clone_copies or not svg_file or not os.path.isfile(svg_file): return False
+    docinfo = effect.document.docinfo
+    if (docinfo.encoding or 'UTF-8').upper() not in ('UTF-8', 'UTF8', 'US-ASCII', 'ASCII'): return False
+
+    f = open(svg_file, 'rb')
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):                         # e.g. an empty file
+        f.close()
+        return False
+    try:
+        splices = patch_splices(effect.document.getroot(), effect.edits, data)
+        if splices is None: return False
+
+        position = 0
+        for start, end, replacement in splices:
+            stream.write(buffer(data, position, start - position))      # buffers, so the unchanged bytes aren't copied
+            stream.write(replacement)
+            position = end
+        stream.write(buffer(data, position))
+        return True
+    finally:
+        data.close()
+        f.close()